@@ -3,59 +3,147 @@ import numpy as np
 import time
 from pathlib import Path
 from datetime import datetime
+from contextlib import contextmanager
 import traceback
 import serial
-import importlib.util
 import json
+import writers
+import simulators
+import planner
+import checkpoint
+import sessions
+import transitions
+import liveview
+import catalog
+import steadystate
+import adaptive
 
 class COMM:
-    def __init__(self, port) -> None:
+    # Every command is answered with one line, "1" (or "0"), once the relays have
+    # switched. Replies come back in order, so command number k is done when k
+    # replies were read. setPin skips the write if the pin is already selected.
+    # With pipelined the commands are newline terminated and sent without waiting
+    # for the previous reply; this needs firmware that splits commands at newlines.
+    # Transitions then wait for the relays in their LED step (Run.transition_steps).
+    # Pixel groups (several smu_channels, see run_group) select all their pixels
+    # with one comma separated command, "R0G6,R0G7"; this needs firmware that
+    # connects every listed pixel, each to its own SMU channel.
+    ack_timeout = 5
+
+    def __init__(self, port, pipelined=False) -> None:
         print("COMM connecting... ", port)
-        self.port = serial.Serial(port,115200, timeout =10)
+        if port.startswith("sim"):
+            self.port = simulators.SimArduino(port, 115200, timeout =10)
+        else:
+            self.port = serial.Serial(port,115200, timeout =10)
         resp = self.port.readline().decode().strip()
         assert resp == "Ready!", "Invalid COMM responce"
+        self.pipelined = pipelined
+        self.sent = 0
+        self.acked = 0
+        self.pending = {}   # command number -> (command, send time)
+        self.last_ack = 0.0
+        self.pin = None
+        self.resume()
         print("COMM connected")
-    def wait_responce(self):
-        answered = False
-        start_time = time.time()
-        while (self.port.in_waiting > 0) or not answered:
+    def send(self, cmd):
+        if not self.pipelined:
+            self.wait()
+        self.port.write((cmd + "\n" if self.pipelined else cmd).encode())
+        self.sent += 1
+        self.pending[self.sent] = (cmd, time.perf_counter())
+        return self.sent
+    def wait(self, seq=None):
+        # until command seq (default: everything sent) is answered
+        seq = self.sent if seq is None else seq
+        while self.acked < seq:
             resp = self.port.readline().decode().strip()
             if resp == '0' or resp == '1':
-                answered = True
-            else:
+                self.acked += 1
+                cmd, sent_time = self.pending.pop(self.acked)
+                now = time.perf_counter()
+                if not cmd.startswith("setdelay"):
+                    # from the moment the board could start on it
+                    self.switch_times.append(now - max(sent_time, self.last_ack))
+                self.last_ack = now
+                if resp == '0':
+                    print("COMM: {} answered 0".format(cmd))
+                    self.pin = None
+            elif resp != "":
                 print(resp)
-            if (time.time() - start_time) > 5:
+            if self.acked < seq and time.perf_counter() - max(self.pending[self.acked + 1][1], self.last_ack) > self.ack_timeout:
                 self.disconnect()
                 raise TimeoutError("COMM timeout exception")
-    def setPin(self, pin=""):
-        self.port.write(pin.encode())
-        self.wait_responce()
+    def setPin(self, pin="", wait=True):
+        # returns the command number to wait() for, None if nothing was sent
+        if pin == self.pin:
+            self.skipped += 1
+            return None
+        self.pin = pin
+        seq = self.send(pin)
+        if wait:
+            self.wait(seq)
+        return seq
     def setDelay(self, delay):
-        self.port.write("setdelay {}".format(delay).encode())
-        self.wait_responce()
+        self.wait(self.send("setdelay {}".format(delay)))
+    def stats(self):
+        times = np.array(self.switch_times)
+        return {
+            "switches": len(times),
+            "skipped": self.skipped,
+            "mean_switch_time": float(times.mean()) if len(times) else None,
+            "p95_switch_time": float(np.percentile(times, 95)) if len(times) else None,
+            "max_switch_time": float(times.max()) if len(times) else None,
+        }
+    # session pool, see sessions.py
+    def check(self):
+        return self.port.is_open
+    def park(self):
+        self.wait()
+    def resume(self):
+        self.switch_times = []
+        self.skipped = 0
     def disconnect(self):
         self.port.close()
         print("COMM disconnected")
 
 class Run(T.Thread):
-    def __init__(self, update_signal_chart = lambda *args: None, send_stop_run = lambda *args:None):
+    def __init__(self, update_signal_chart = lambda *args: None, send_stop_run = lambda *args:None, send_progress = lambda *args:None):
         super(Run, self).__init__(daemon=True)
         print("Thread init..")
         self._stop_event = T.Event()
         self.update_signal_chart = update_signal_chart
         self.send_stop_run = send_stop_run
+        self.send_progress = send_progress
+        # live signal for the dashboard; more subscribers can be added with self.live.subscribe
+        self.live = liveview.LiveView()
+        self.live.subscribe(self.chart_update)
         self.pixel_time_left = -1
         self.total_time_left = -1
         self.dashboard = False
 
+    # keys taken from the new configuration when a run is resumed; the sweep
+    # itself always comes from the conf.json of the resumed folder
+    resume_keys = ["smu_port", "led_port", "comm_port"]
+
     def start_run(self,configuration):
         print("Thread start..")
-        self.conf = configuration
         self._stop_event.clear()
-        self.outputfolder = "./output/{}".format(  configuration['output_folder'].format(timestamp=datetime.now().strftime("%m_%d_%Y-%H_%M_%S")))
-        Path(self.outputfolder).mkdir(parents=True, exist_ok=True)
-        with open("{}/conf.json".format(self.outputfolder), "w") as write_file:
-            json.dump(configuration, write_file, indent=4)
+        self.resume = bool(configuration.get("resume_folder"))
+        if self.resume:
+            self.outputfolder = configuration["resume_folder"]
+            with open("{}/conf.json".format(self.outputfolder)) as read_file:
+                self.conf = json.load(read_file)
+            self.conf.update({key: configuration[key] for key in self.resume_keys if key in configuration})
+            print("Resuming run in {}".format(self.outputfolder))
+        else:
+            self.conf = configuration
+            self.outputfolder = "./output/{}".format(  configuration['output_folder'].format(timestamp=datetime.now().strftime("%m_%d_%Y-%H_%M_%S")))
+            Path(self.outputfolder).mkdir(parents=True, exist_ok=True)
+            with open("{}/conf.json".format(self.outputfolder), "w") as write_file:
+                json.dump(configuration, write_file, indent=4)
+        self.live.rate = self.conf.get("live_rate", 5)
+        self.live.points = self.conf.get("live_points", 500)
         self.start()
 
     def stop_run(self):
@@ -64,145 +152,335 @@ class Run(T.Thread):
     def stopped(self):
         return self._stop_event.is_set()
 
+    @contextmanager
+    def timed(self, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats[key] += time.perf_counter() - start
+
+    def measure(self, smu, channels=None):
+        with self.timed("acquire_time"):
+            data = smu.measureVI() if channels is None else smu.measureVI(channels)
+        blocks = [data] if channels is None else data
+        self.stats["blocks"] += len(blocks)
+        self.stats["samples"] += sum(len(block) if np.ndim(block) == 2 else 1 for block in blocks)
+        return data
+
+    def write_block(self, writer, smu, data):
+        writer.write(data)
+        records = smu.pop_records() if hasattr(smu, "pop_records") else None
+        if records is not None:
+            writer.write_records(records)
+
+    def catalog_update(self, function, *args):
+        # the catalog only indexes the run folders, a failure must not stop the run
+        if not self.conf.get("catalog", True):
+            return
+        try:
+            function(self.outputfolder, *args)
+        except Exception:
+            print(traceback.format_exc())
+
+    def detector(self, phase):
+        rows = None
+        if not self.conf["ispulseused"]:
+            rows = len(self.conf["smu_v_profile_rec" if phase == "recovery" else "smu_v_profile"]) * self.conf.get("steady_dc_cycles", 1)
+        return steadystate.Detector(self.conf, phase, rows)
+
+    def transition_steps(self, comm, led, pin, current, smu_step=None):
+        # With comm_pipelined the relay step only sends the command and the LED
+        # step waits for its reply, so the SMU configures while the relays switch
+        # (also with transition_workers 0, the steps run in the order listed).
+        steps = {"relay": lambda: comm.setPin(pin, wait=not comm.pipelined)}
+        if smu_step is not None:
+            steps["smu"] = smu_step
+        if comm.pipelined:
+            steps["led"] = lambda: (comm.wait(), led.setCurrent(current))
+        else:
+            steps["led"] = lambda: led.setCurrent(current)
+        return steps
+
+    def early_exit(self, detector, name, Period, Vf_prof, Duty_cycle, phase):
+        elapsed = time.time() - detector.start
+        print("{} {} ended after {:.1f} s: {}".format(name, phase, elapsed, detector.reason))
+        self.stats["early_exits"].append({"pixel": name, "Period": Period, "Vf": Vf_prof, "Duty": Duty_cycle, "phase": phase, "time": elapsed, "reason": detector.reason})
+
+    def chart_update(self, update):
+        # update_signal_chart gets the newest bucket of every live update
+        v = (update["v_min"][-1] + update["v_max"][-1]) / 2
+        i = (update["i_min"][-1] + update["i_max"][-1]) / 2
+        self.update_signal_chart(float(v), float(i), update["index"], update["new"])
+
+    def progress(self, pixels, Period, Vf_prof, Duty_cycle):
+        self.send_progress({"step": self.stats["sweep_points"] + self.resumed_points, "steps": self.total_steps, "pixels": [pixel["ext"] + pixel["inn"] for pixel in pixels], "Period": Period, "Vf": Vf_prof, "Duty": Duty_cycle})
+
+    def run_pixel(self, smu, led, comm, writer, pixel, Period, Vf_prof, Duty_cycle):
+        # Stress and recovery of one pixel at one sweep point. Returns True if the run was stopped.
+        Vr_prof = self.conf["Vr_prof"]
+        Tr = Duty_cycle * Period
+        Tf = (1-Duty_cycle) * Period
+        print("Start with Vr_prof: {} Vf_prof: {} Tr: {} Tf: {}".format(Vr_prof, Vf_prof, Tr, Tf))
+        p_iter = self.conf["pixel_loop"]["loop"].index(pixel)
+        with self.timed("setup_time"):
+            # IF PULSE
+            configure = None
+            if self.conf["ispulseused"] :
+                configure = lambda: smu.configure(planner.pulse_conf(self.conf, Period, Vf_prof, Duty_cycle))
+            self.transition.run(self.transition_steps(comm, led, pixel["ext"] + pixel["inn"], pixel["curr"], configure))
+        self.stats["sweep_points"] += 1
+        self.progress([pixel], Period, Vf_prof, Duty_cycle)
+        self.current_pixel = pixel
+        name = pixel["ext"] + pixel["inn"]
+        self.live.begin(name, p_iter)
+        pixel_start_time = time.time()
+        print("Pixel {}: I={}".format(p_iter, pixel['curr']))
+
+        with writer.segment(pixel, Period, Vf_prof, Duty_cycle, "stress"):
+            detector = self.detector("stress")
+            while time.time() - pixel_start_time < self.conf["smu_t_total"]:
+                if self.conf["ispulseused"]:
+                    data = self.measure(smu)
+                    self.write_block(writer, smu, data)
+                    self.live.push(name, data)
+                    if (self._stop_event.is_set()):
+                        return True
+                    if detector.update(data):
+                        break
+                else:
+                    for v_iter,volt_norm in enumerate(np.array(self.conf["smu_v_profile"])):
+                        volt = Vf_prof if volt_norm == 1 else (Vr_prof if volt_norm == -1 else 0) 
+                        smu.applyV(volt)
+                        time_to_sleep = Tf if volt_norm == 1 else (Tr if volt_norm == -1 else Period) 
+                        time.sleep(time_to_sleep)
+                        real_v,i = self.measure(smu)
+                        t = time.time()-pixel_start_time
+                        writer.write_row(t, real_v, i)
+                        self.live.push(name, [[real_v, i, t]])
+                        print(volt,time_to_sleep)
+                        if (self._stop_event.is_set()):
+                            return True
+                        if detector.update([[real_v, i, t]]):
+                            break
+                    smu.applyV(0)
+                    if detector.reason:
+                        break
+            if detector.reason:
+                self.early_exit(detector, name, Period, Vf_prof, Duty_cycle, "stress")
+            # RECOVERY
+            print("RECOVERY")
+            writer.set_phase("recovery")
+            if self.conf["ispulseused"]:
+                with self.timed("setup_time"):
+                    smu.configure(self.conf["smu_custom_pars_rec"], False)
+            recovery_start_time = time.time()
+            detector = self.detector("recovery")
+            while time.time() - recovery_start_time < self.conf["smu_t_total_rec"]:
+                if self.conf["ispulseused"]:
+                    data = self.measure(smu)
+                    self.write_block(writer, smu, data)
+                    self.live.push(name, data)
+                    if (self._stop_event.is_set()):
+                        return True
+                    if detector.update(data):
+                        break
+                else:
+                    for v_iter,volt in enumerate(np.array(self.conf["smu_v_profile_rec"])* self.conf["smu_v_factor_rec"]):
+                        smu.applyV(volt)
+                        time.sleep(self.conf["smu_t_step_rec"])
+                        real_v,i = self.measure(smu)
+                        t = time.time()-pixel_start_time
+                        writer.write_row(t, real_v, i)
+                        self.live.push(name, [[real_v, i, t]])
+                        if (self._stop_event.is_set()):
+                            return True
+                        if detector.update([[real_v, i, t]]):
+                            break
+                    smu.applyV(0)
+                    if detector.reason:
+                        break
+            if detector.reason:
+                self.early_exit(detector, name, Period, Vf_prof, Duty_cycle, "recovery")
+        return False
+
+    def run_group(self, smu, led, comm, channel_writers, group, Period, Vf_prof, Duty_cycle, stress_conf):
+        # The pixels of a group are measured at the same time, one per SMU channel.
+        # Each channel runs its own stress -> recovery schedule and drops out of the
+        # block acquisition once its recovery is over. Returns True if the run was stopped.
+        # The relays get all pixels in one command, see COMM for the firmware it needs.
+        channels = self.conf["smu_channels"][:len(group)]
+        def configure_channels():
+            for ch in channels:
+                smu.configure(dict(stress_conf, channel={"value": ch}))
+        with self.timed("setup_time"):
+            self.transition.run(self.transition_steps(comm, led, ",".join(pixel["ext"] + pixel["inn"] for pixel in group), group[0]["curr"], configure_channels))
+        self.stats["sweep_points"] += len(group)
+        self.progress(group, Period, Vf_prof, Duty_cycle)
+        print("Pixels {}: I={}".format(", ".join(pixel["ext"] + pixel["inn"] for pixel in group), group[0]["curr"]))
+
+        start = time.time()
+        state = {}
+        names = {}
+        for ch, pixel in zip(channels, group):
+            state[ch] = {"phase": "stress", "start": start, "detector": self.detector("stress")}
+            channel_writers[ch].begin(pixel, Period, Vf_prof, Duty_cycle, "stress")
+            names[ch] = pixel["ext"] + pixel["inn"]
+            self.live.begin(names[ch], self.conf["pixel_loop"]["loop"].index(pixel))
+        try:
+            while True:
+                active = [ch for ch in channels if state[ch]["phase"] != "done"]
+                if not active:
+                    return False
+                if self._stop_event.is_set():
+                    return True
+                for ch, data in zip(active, self.measure(smu, active)):
+                    channel_writers[ch].write(data)
+                    self.live.push(names[ch], data)
+                    state[ch]["detector"].update(data)
+                now = time.time()
+                for ch in active:
+                    detector = state[ch]["detector"]
+                    if detector.reason:
+                        self.early_exit(detector, names[ch], Period, Vf_prof, Duty_cycle, state[ch]["phase"])
+                    if state[ch]["phase"] == "stress" and (detector.reason or now - state[ch]["start"] >= self.conf["smu_t_total"]):
+                        print("RECOVERY ch{}".format(ch))
+                        state[ch] = {"phase": "recovery", "start": now, "detector": self.detector("recovery")}
+                        channel_writers[ch].set_phase("recovery")
+                        with self.timed("setup_time"):
+                            smu.configure(dict(self.conf["smu_custom_pars_rec"], channel={"value": ch}), False)
+                    elif state[ch]["phase"] == "recovery" and (detector.reason or now - state[ch]["start"] >= self.conf["smu_t_total_rec"]):
+                        state[ch]["phase"] = "done"
+        finally:
+            for ch in channels:
+                channel_writers[ch].end()
+
     def run(self):
         print("Thread started..")
         smu = None
         led = None
         comm = None
+        writer = None
+        channel_writers = {}
+        self.transition = None
+        self.stats = {"blocks": 0, "samples": 0, "sweep_points": 0, "acquire_time": 0.0, "setup_time": 0.0, "wall_time": 0.0, "early_exits": []}
+        self.resumed_points = 0
+        run_start_time = time.perf_counter()
+        self.catalog_update(catalog.add_run, self.conf)
         try:
+            self.transition = transitions.Transition(self.conf)
+            self.live.start()
             print("Instruments configuration...")
-            smu_mod_spec=importlib.util.spec_from_file_location("{}".format(self.conf["smu_type"]),"smu_drivers/{}.py".format(self.conf["smu_type"]))
-            smu_mod = importlib.util.module_from_spec(smu_mod_spec)
-            smu_mod_spec.loader.exec_module(smu_mod)
+            smu_mod = sessions.load_driver("smu_drivers", self.conf["smu_type"])
+            led_mod = sessions.load_driver("led_drivers", self.conf["led_type"])
 
-            led_mod_spec=importlib.util.spec_from_file_location("{}".format(self.conf["led_type"]),"led_drivers/{}.py".format(self.conf["led_type"]))
-            led_mod = importlib.util.module_from_spec(led_mod_spec)
-            led_mod_spec.loader.exec_module(led_mod)
-            
-            
-            led = led_mod.LED(self.conf["led_port"])
-            smu = smu_mod.SMU(self.conf["smu_port"], self.conf["smu_custom_pars"])
-            comm = COMM(self.conf["comm_port"])
+            # instruments left open by a previous run of this process are reused
+            led = sessions.acquire("led", self.conf["led_type"], self.conf["led_port"], lambda: led_mod.LED(self.conf["led_port"]))
+            led.readback = self.conf.get("led_readback", False)
+            smu = sessions.acquire("smu", self.conf["smu_type"], self.conf["smu_port"], lambda: smu_mod.SMU(self.conf["smu_port"], self.conf["smu_custom_pars"]), self.conf["smu_custom_pars"])
+            comm = sessions.acquire("comm", "COMM", self.conf["comm_port"], lambda: COMM(self.conf["comm_port"], self.conf.get("comm_pipelined", False)))
+            comm.pipelined = self.conf.get("comm_pipelined", False)
             comm.setDelay(self.conf["comm_relay_delay"])
-            
+
+            completed, entries, files = set(), [], {}
+            if self.resume:
+                # drop what the interrupted step wrote before the writers reopen the files
+                completed, entries, files = checkpoint.load(self.outputfolder)
+                checkpoint.truncate(self.outputfolder, files)
+            # with several smu_channels (pulse mode) pixels are measured in groups, one per channel
+            channels = self.conf.get("smu_channels", [])
+            group_mode = self.conf["ispulseused"] and len(channels) > 1
+            if group_mode:
+                channel_writers = {ch: writers.make_writer(self.conf, self.outputfolder, "data_ch{}".format(ch)) for ch in channels}
+            else:
+                writer = writers.make_writer(self.conf, self.outputfolder)
             print("Instruments ready")
             stop_run_flag = False
 
-            Vr_prof = self.conf["Vr_prof"]
-            Vf_prof_arr = self.conf["Vf_prof_arr"]   # generate array from 0 to 1 (incl) with 0.25 step
-            Duty_cycles = self.conf["Duty_cycles"]  # Tr/Tf
-            Periods = self.conf["smu_periods_arr"]
-            
+            plan = planner.make_plan(self.conf)
+            planner.save_plan(self.conf, plan, self.outputfolder)
+            steps = planner.plan_steps(self.conf, plan)
+            self.total_steps = sum(len(pixels) for _, _, _, pixels in steps)
+            print("Plan: {} steps, order {}{}, estimated {:.0f} s ({:.0f} s switching, legacy order {:.0f} s)".format(
+                len(steps), " > ".join(plan["order"]), " (serpentine)" if plan["serpentine"] else "",
+                plan["estimate"]["total_time"], plan["estimate"]["switch_time"], plan["legacy_estimate"]["switch_time"]))
+
+            # adaptive sweep: more steps are added once the planned ones are done
+            refiner = adaptive.Refiner(self.conf, self.outputfolder) if self.conf.get("sweep_mode", "grid") == "adaptive" else None
+            done = dict((entry["step"], entry) for entry in entries)
+            self.resumed_points = sum(len(entry["pixels"]) for entry in entries)
+            if completed and refiner is None:
+                print("Resuming: {} of {} steps already completed".format(len(completed), len(steps)))
+            elif completed:
+                print("Resuming: {} steps already completed, adaptive rounds follow from their summaries".format(len(completed)))
 
-            for Period in Periods:
-                for Vf_prof in Vf_prof_arr:
-                    for Duty_cycle in Duty_cycles:
-
-                        Tr = Duty_cycle * Period
-                        Tf = (1-Duty_cycle) * Period
-                        print("Start with Vr_prof: {} Vf_prof: {} Tr: {} Tf: {}".format(Vr_prof, Vf_prof, Tr, Tf))
-
-                        # IF PULSE
-                        if self.conf["ispulseused"] :
-                            current_conf = self.conf["smu_custom_pars"] 
-                            current_conf["pulsevoltage"] = {"value": Vf_prof}
-                            current_conf["basevoltage"] = {"value": Vr_prof}
-                            current_conf["pulsewidth"] = {"value": Tf}
-                            # current_conf["period"] = {"value": Period}
-                            current_conf["pulsedelay"] = {"value": Period - Tf}
-                            smu.configure(current_conf)
-
-                        for p_iter, pixel in enumerate(self.conf["pixel_loop"]["loop"]):
-                            self.current_pixel = pixel
-                            comm.setPin(pixel["ext"] + pixel["inn"])
-                            led.setCurrent(pixel["curr"])
-                            pixel_start_time = time.time()
-                            # self.update_signal_chart(pixel_no = p_iter)
-                            newpixel_flag = True
-
-                            print("Pixel {}: I={}".format(p_iter, pixel['curr']))
-                            
-                            with open("{}/{}{}_TimeStep-{}_Vf-{}_Duty-{}.txt".format(self.outputfolder, pixel["ext"], pixel["inn"], Period, Vf_prof, Duty_cycle), 'a') as f:
-                                print("#pixel_time[s]\tV[V]\tI[A]",file=f)
-                                while time.time() - pixel_start_time < self.conf["smu_t_total"]:
-                                    if self.conf["ispulseused"]:
-                                        data = smu.measureVI()
-                                        for line in range(data.shape[0]):
-                                            print("{}\t{}\t{}".format(data[line,2], data[line,0], data[line,1]), file=f)        
-                                    else:
-                                        for v_iter,volt_norm in enumerate(np.array(self.conf["smu_v_profile"])):
-                                        
-                                            volt = Vf_prof if volt_norm == 1 else (Vr_prof if volt_norm == -1 else 0) 
-                                            smu.applyV(volt)
-                                            time_to_sleep = Tf if volt_norm == 1 else (Tr if volt_norm == -1 else Period) 
-                                            time.sleep(time_to_sleep)
-                                            real_v,i = smu.measureVI()
-                                            print("{}\t{}\t{}".format(time.time()-pixel_start_time, real_v, i), file=f)
-                                            print(volt,time_to_sleep)
-                                            if (self._stop_event.is_set()):
-                                                stop_run_flag = True
-                                                break
-                                            # if self.conf["smu_recovery_enable"] and (i > self.conf["smu_rec_thresh"]):
-                                            #     break
-                                        else:
-                                            smu.applyV(0)
-                                            continue
-                                        break
-                                else:
-                                    print("Recovery")
-                                if stop_run_flag:
-                                    break
-                                # RECOVERY
-                                print("RECOVERY")
-                                smu.configure(self.conf["smu_custom_pars_rec"], False)
-                                recovery_start_time = time.time()
-                                while time.time() - recovery_start_time < self.conf["smu_t_total_rec"]:
-                                    if self.conf["ispulseused"]:
-                                        data = smu.measureVI()
-                                        for line in range(data.shape[0]):
-                                            print("{}\t{}\t{}".format(data[line,2], data[line,0], data[line,1]), file=f)        
-                                    else:
-                                        for v_iter,volt in enumerate(np.array(self.conf["smu_v_profile_rec"])* self.conf["smu_v_factor_rec"]):
-                                            smu.applyV(volt)
-                                            time.sleep(self.conf["smu_t_step_rec"])
-                                            real_v,i = smu.measureVI()
-                                            print("{}\t{}\t{}".format(time.time()-pixel_start_time, real_v, i), file=f)
-                                            self.update_signal_chart(real_v,i, p_iter, newpixel_flag)
-                                            newpixel_flag = False
-                                            if (self._stop_event.is_set()):
-                                                stop_run_flag = True
-                                                break
-                                        else:
-                                            smu.applyV(0)
-                                            continue
-                                        break
-                                else:
-                                    continue
-                                break
+            k = 0
+            while True:
+                if k == len(steps):
+                    new_steps = refiner.refine() if refiner is not None else []
+                    if not new_steps:
+                        break
+                    steps += new_steps
+                    self.total_steps += sum(len(pixels) for _, _, _, pixels in new_steps)
+                Period, Vf_prof, Duty_cycle, pixels = steps[k]
+                if k in done:
+                    entry = done[k]
+                    if [Period, Vf_prof, Duty_cycle, [pixel["ext"] + pixel["inn"] for pixel in pixels]] != [entry["Period"], entry["Vf"], entry["Duty"], entry["pixels"]]:
+                        raise Exception("Checkpoint step {} does not match the plan".format(k))
+                    k += 1
+                    continue
+                if group_mode:
+                    stop_run_flag = self.run_group(smu, led, comm, channel_writers, pixels, Period, Vf_prof, Duty_cycle, planner.pulse_conf(self.conf, Period, Vf_prof, Duty_cycle))
+                else:
+                    stop_run_flag = self.run_pixel(smu, led, comm, writer, pixels[0], Period, Vf_prof, Duty_cycle)
+                if stop_run_flag:
+                    break
+                for open_writer in [writer] + list(channel_writers.values()):
+                    if open_writer is not None:
+                        files.update(open_writer.sync())
+                entry = {"step": k, "Period": Period, "Vf": Vf_prof, "Duty": Duty_cycle, "pixels": [pixel["ext"] + pixel["inn"] for pixel in pixels], "files": files}
+                checkpoint.append(self.outputfolder, entry)
+                self.catalog_update(catalog.add_step, entry)
+                k += 1
 
             self.send_stop_run()
-            smu.disconnect()
-            led.disconnect()
-            comm.disconnect()
+            if writer is not None:
+                writer.close()
+                self.stats["writer"] = writer.stats()
+            for ch, channel_writer in channel_writers.items():
+                channel_writer.close()
+                self.stats["writer_ch{}".format(ch)] = channel_writer.stats()
+            self.stats["comm"] = comm.stats()
+            self.stats["transition"] = self.transition.stats()
+            self.transition.close()
+            self.live.close()
+            self.stats["live"] = self.live.stats()
+            if hasattr(smu, "acquisition_stats"):
+                self.stats["smu"] = dict(smu.acquisition_stats(), transactions=smu.transactions())
+            self.stats["wall_time"] = time.perf_counter() - run_start_time
+            print("Run stats: {}".format(self.stats))
+            self.catalog_update(catalog.finish_run, "stopped" if stop_run_flag else "completed", self.stats)
+            sessions.release("smu", self.conf["smu_type"], self.conf["smu_port"], smu)
+            sessions.release("led", self.conf["led_type"], self.conf["led_port"], led)
+            sessions.release("comm", "COMM", self.conf["comm_port"], comm)
             print("Completed!")
         except Exception as e:
             self.send_stop_run(False, "Runtime exception {}: {}".format(type(e).__name__, e))
             print(traceback.format_exc())
-            if not (smu is None): 
-                try:
-                    smu.disconnect()
-                except Exception:
-                    print(traceback.format_exc())
-            if not (led is None): 
-                try:
-                    led.disconnect()
-                except Exception:
-                    print(traceback.format_exc())
-            if not (comm is None):
-                try: 
-                    comm.disconnect()
-                except Exception:
-                    print(traceback.format_exc())
+            self.catalog_update(catalog.finish_run, "failed", {"error": "{}: {}".format(type(e).__name__, e)})
+            if self.transition is not None:
+                self.transition.close()
+            self.live.close()
+            for open_writer in [writer] + list(channel_writers.values()):
+                if not (open_writer is None):
+                    try:
+                        open_writer.close()
+                    except Exception:
+                        print(traceback.format_exc())
+            # a failed instrument may be left mid-command, it is not pooled
+            for inst in (smu, led, comm):
+                if not (inst is None):
+                    sessions.discard(inst)
             
         
                 
\ No newline at end of file
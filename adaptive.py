@@ -0,0 +1,98 @@
+import json
+import itertools
+import numpy as np
+import planner
+import reducers
+
+# Adaptive sweep ("sweep_mode": "adaptive"). smu_periods_arr, Vf_prof_arr and
+# Duty_cycles are the coarse grid, measured first as planned. After that, every
+# refinement round compares the response of neighbouring points along each axis
+# (same values on the other two) and measures the midpoint where they differ by
+# more than adaptive_tol * the larger response + adaptive_tol_abs, for any pixel.
+# Rounds go on until nothing differs, the sweep has adaptive_budget points
+# (Period/Vf/Duty combinations, every one measured on all pixels), or the
+# intervals are adaptive_levels halvings below the closest coarse spacing.
+# The response is adaptive_metric of the adaptive_phase segment, read from the
+# summary files (see reducers.py). Rounds are saved to adaptive.json; a resumed
+# run repeats them from the summaries of its completed steps.
+axes = ["Period", "Vf", "Duty"]
+metrics = {
+    "I_mean": ("welford", lambda result: result["welford"]["mean"]["I"]),
+    "I_std": ("welford", lambda result: result["welford"]["std"]["I"]),
+    "I_min": ("minmax", lambda result: result["minmax"]["min"]["I"]),
+    "I_max": ("minmax", lambda result: result["minmax"]["max"]["I"]),
+}
+
+class Refiner:
+    def __init__(self, conf, outputfolder) -> None:
+        self.outputfolder = outputfolder
+        self.budget = conf.get("adaptive_budget", 40)
+        self.tol = conf.get("adaptive_tol", 0.1)
+        self.tol_abs = conf.get("adaptive_tol_abs", 0)
+        self.levels = conf.get("adaptive_levels", 3)
+        self.metric_name = conf.get("adaptive_metric", "I_mean")
+        if self.metric_name not in metrics:
+            raise Exception("Unknown adaptive_metric: {}".format(self.metric_name))
+        reducer, self.metric = metrics[self.metric_name]
+        if reducer not in conf.get("reducers", reducers.default_reducers):
+            raise Exception("adaptive_metric {} needs the {} reducer".format(self.metric_name, reducer))
+        self.phase = conf.get("adaptive_phase", "stress")
+        self.units = planner.loop_values(conf)["pixel"]
+        coarse = [sorted(conf["smu_periods_arr"]), sorted(conf["Vf_prof_arr"]), sorted(conf["Duty_cycles"])]
+        self.min_step = [np.diff(values).min() / 2 ** self.levels if len(values) > 1 else 0 for values in coarse]
+        self.points = set(itertools.product(*coarse))
+        self.rounds = []
+
+    def response(self, point):
+        # metric of every pixel at a point, None where there is no summary
+        values = []
+        for unit in self.units:
+            for pixel in unit:
+                try:
+                    with open(reducers.summary_file(self.outputfolder, pixel["ext"] + pixel["inn"], *point)) as f:
+                        values.append(self.metric(json.load(f)["phases"][self.phase]))
+                except (OSError, KeyError):
+                    values.append(None)
+        return values
+
+    def difference(self, a, b):
+        # largest difference beyond the tolerance over the pixels, 0 if none
+        worst = 0
+        for ra, rb in zip(a, b):
+            if ra is None or rb is None:
+                continue
+            excess = abs(ra - rb) - self.tol * max(abs(ra), abs(rb)) - self.tol_abs
+            worst = max(worst, excess)
+        return worst
+
+    def refine(self):
+        # steps (Period, Vf, Duty, pixels) of the next round, [] when done
+        room = self.budget - len(self.points)
+        if room <= 0:
+            return []
+        responses = dict((point, self.response(point)) for point in self.points)
+        candidates = {}
+        for axis in range(len(axes)):
+            lines = {}
+            for point in self.points:
+                lines.setdefault(point[:axis] + point[axis+1:], []).append(point)
+            for line in lines.values():
+                line.sort(key=lambda point: point[axis])
+                for a, b in zip(line, line[1:]):
+                    if (b[axis] - a[axis]) / 2 < self.min_step[axis]:
+                        continue
+                    excess = self.difference(responses[a], responses[b])
+                    if excess > 0:
+                        # rounded, the value ends up in file names
+                        middle = float("{:.12g}".format((a[axis] + b[axis]) / 2))
+                        point = a[:axis] + (middle,) + a[axis+1:]
+                        candidates[point] = max(candidates.get(point, 0), excess)
+        new = sorted(sorted(candidates, key=lambda point: -candidates[point])[:room])
+        if not new:
+            return []
+        self.points.update(new)
+        self.rounds.append({"points": [dict(zip(axes, point), excess=candidates[point]) for point in new], "total_points": len(self.points)})
+        with open("{}/adaptive.json".format(self.outputfolder), "w") as write_file:
+            json.dump({"metric": self.metric_name, "phase": self.phase, "budget": self.budget, "rounds": self.rounds}, write_file, indent=4)
+        print("Adaptive round {}: {} new points, {} of {}".format(len(self.rounds), len(new), len(self.points), self.budget))
+        return [point + (unit,) for point in new for unit in self.units]
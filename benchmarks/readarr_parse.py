@@ -0,0 +1,69 @@
+# Parse time and peak memory of a READ:ARR? payload, old list path vs the driver's
+# readblock() + np.frombuffer path (read from an in-memory simulated resource).
+# Run from the repository root: python benchmarks/readarr_parse.py [points]
+import os
+import sys
+import time
+import struct
+import tracemalloc
+import importlib.util
+import multiprocessing as mp
+import numpy as np
+
+sys.path.insert(0, os.getcwd())
+import simulators
+
+def load_driver():
+    spec = importlib.util.spec_from_file_location("agilent_b29xx_pulse", "smu_drivers/agilent_b29xx_pulse.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def make_payload(points):
+    body = np.random.default_rng(0).random(points * 3).astype(">f8").tobytes()
+    length = str(len(body)).encode()
+    return b"#" + str(len(length)).encode() + length + body + b"\n"
+
+def parse_legacy(raw):
+    # what query_binary_values + getSensData + np.array(data) did before
+    n = int(raw[1:2])
+    length = int(raw[2:2+n])
+    res = list(struct.unpack(">{}d".format(length // 8), raw[2+n:2+n+length]))
+    formatted_data = []
+    for i in range(0,len(res),3):
+        formatted_data.append([res[j] for j in range(i,i+3)])
+    return np.array(formatted_data)
+
+def parse_buffer(raw):
+    # the driver path: SMU.readblock() and np.frombuffer, as in querybincmd
+    smu = driver.SMU.__new__(driver.SMU)
+    smu.inst = simulators.SimVisa("sim?latency=0&bandwidth=1e15")
+    smu.inst.responses.append(raw)
+    payload = smu.readblock()
+    return np.frombuffer(payload, dtype=driver.sens_dtype, count=len(payload) // driver.sens_dtype.itemsize).reshape(-1, 3)
+
+def measure(name, points, out):
+    global driver
+    driver = load_driver()
+    raw = make_payload(points)
+    parse = parse_legacy if name == "legacy" else parse_buffer
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = parse(raw)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert data.shape == (points, 3)
+    out.put((name, elapsed, peak))
+
+if __name__ == "__main__":
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    print("READ:ARR? payload: {} points ({:.1f} MB)".format(points, points * 24 / 1e6))
+    out = mp.Queue()
+    for name in ["legacy", "buffer"]:
+        # separate process so one variant's garbage does not affect the other
+        p = mp.Process(target=measure, args=(name, points, out))
+        p.start()
+        name, elapsed, peak = out.get()
+        p.join()
+        print("{:8s} parse {:9.4f} s   peak {:9.2f} MB".format(name, elapsed, peak / 1e6))
@@ -0,0 +1,161 @@
+# End-to-end throughput of the Run sweep loop against the simulated instruments.
+# Run from the repository root:
+#   python benchmarks/sweep_throughput.py [--quick] [--only NAME] [--keep]
+#   python benchmarks/sweep_throughput.py --compare old.json new.json
+# Results are stored in benchmarks/results/<commit>_<timestamp>.json
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+import multiprocessing as mp
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+sys.path.insert(0, os.getcwd())
+
+results_folder = "benchmarks/results"
+sim_ports = {
+    "smu_port": "sim?latency=0.0005&bandwidth=4e6",
+    "led_port": "sim",
+    "comm_port": "sim",
+}
+
+def pixels(n):
+    return [{"ext": "R{}".format(k // 8), "inn": "G{}".format(k % 8), "curr": 0.01} for k in range(n)]
+
+def dc_case(name, n_pixels, t_total=1.0):
+    with open("conf.json") as f:
+        conf = json.load(f)
+    conf.update(sim_ports, smu_type="sim_b29xx", led_type="sim_dps_5005", ispulseused=False,
+                Vr_prof=-0.5, Vf_prof_arr=[0.5], Duty_cycles=[0.5], smu_periods_arr=[0.01],
+                smu_t_total=t_total, smu_t_total_rec=t_total / 2, smu_t_step_rec=0.005, catalog=False)
+    conf["smu_custom_pars"] = {"nplc": {"value": "0.01"}, "channel": {"value": "1"}}
+    conf["pixel_loop"]["loop"] = pixels(n_pixels)
+    return name, conf
+
+def pulse_case(name, n_pixels, var1count, output_format, t_total=2.0):
+    with open("conf_pulse.json") as f:
+        conf = json.load(f)
+    conf.update(sim_ports, smu_type="sim_b29xx_pulse", led_type="sim_dps_5005", ispulseused=True,
+                Vr_prof=-0.5, Vf_prof_arr=[0.5], Duty_cycles=[0.5], smu_periods_arr=[0.001],
+                smu_t_total=t_total, smu_t_total_rec=t_total / 2, output_format=output_format, catalog=False)
+    for pars in ["smu_custom_pars", "smu_custom_pars_rec"]:
+        conf[pars]["repeat"] = {"value": 1}
+        conf[pars]["var1count"] = {"value": var1count}
+    conf["pixel_loop"]["loop"] = pixels(n_pixels)
+    return name, conf
+
+def cases(quick):
+    yield dc_case("dc_1px", 1)
+    yield pulse_case("pulse_1k_1px_text", 1, 1000, "text")
+    yield pulse_case("pulse_100k_1px_text", 1, 100000, "text")
+    yield pulse_case("pulse_100k_1px_binary", 1, 100000, "binary")
+    if quick:
+        return
+    yield dc_case("dc_4px", 4)
+    yield pulse_case("pulse_1k_4px_binary", 4, 1000, "binary")
+    yield pulse_case("pulse_10k_4px_text", 4, 10000, "text")
+    yield pulse_case("pulse_10k_4px_binary", 4, 10000, "binary")
+    yield pulse_case("pulse_1M_1px_binary", 1, 1000000, "binary")
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+def run_case(name, conf, keep, out):
+    import Run
+    import sessions
+    # the sim ports must not end up in the LED cache of the real supply
+    cache_folder = tempfile.mkdtemp()
+    sessions.load_driver("led_drivers", conf["led_type"]).LED.cache_file = os.path.join(cache_folder, "dps5005_cache.json")
+    conf["output_folder"] = "bench_{}_{{timestamp}}".format(name)
+    run = Run.Run()
+    run.start_run(conf)
+    run.join()
+    shutil.rmtree(cache_folder)
+    size = folder_size(run.outputfolder)
+    if not keep:
+        shutil.rmtree(run.outputfolder)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None
+    out.put((run.stats, size, peak))
+
+def measure(name, conf, keep):
+    out = mp.Queue()
+    p = mp.Process(target=run_case, args=(name, conf, keep, out))
+    p.start()
+    stats, size, peak = out.get()
+    p.join()
+    wall = stats["wall_time"]
+    writer = stats.get("writer", {})
+    smu = stats.get("smu", {})
+    return {
+        "samples": stats["samples"],
+        "blocks": stats["blocks"],
+        "sweep_points": stats["sweep_points"],
+        "wall_time": wall,
+        "samples_per_s": stats["samples"] / wall if wall else 0,
+        "bytes_written": size,
+        "bytes_per_s": size / wall if wall else 0,
+        "sweep_point_overhead": stats["setup_time"] / stats["sweep_points"] if stats["sweep_points"] else None,
+        "acquire_time": stats["acquire_time"],
+        "parse_time": smu.get("parse_time"),
+        "format_time": writer.get("write_time"),
+        "writer_stall_time": writer.get("stall_time"),
+        "peak_rss": peak,
+        "raw": stats,
+    }
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+def show(name, r):
+    print("{:24s} {:>12.0f} samples/s {:>10.2f} MB/s  overhead/pt {:>7.3f} s  parse {:>7.3f} s  format {:>7.3f} s  peak {}".format(
+        name, r["samples_per_s"], r["bytes_per_s"] / 1e6, r["sweep_point_overhead"] or 0,
+        r["parse_time"] or 0, r["format_time"] or 0,
+        "{:.0f} MB".format(r["peak_rss"] / 1e6) if r["peak_rss"] else "n/a"))
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print("{} -> {}".format(old["commit"], new["commit"]))
+    for name, r in new["cases"].items():
+        if name not in old["cases"]:
+            continue
+        o = old["cases"][name]
+        ratio = r["samples_per_s"] / o["samples_per_s"] if o["samples_per_s"] else float("nan")
+        print("{:24s} samples/s {:>12.0f} -> {:>12.0f} ({:.2f}x)".format(name, o["samples_per_s"], r["samples_per_s"], ratio))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--only")
+    parser.add_argument("--keep", action="store_true", help="keep the output folders")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    report = {"commit": commit(), "date": datetime.now().isoformat(), "cases": {}}
+    for name, conf in cases(args.quick):
+        if args.only and args.only != name:
+            continue
+        report["cases"][name] = measure(name, conf, args.keep)
+        show(name, report["cases"][name])
+
+    os.makedirs(results_folder, exist_ok=True)
+    filename = "{}/{}_{}.json".format(results_folder, report["commit"], datetime.now().strftime("%m_%d_%Y-%H_%M_%S"))
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=4)
+    print("Results: {}".format(filename))
@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import sqlite3
+import traceback
+from pathlib import Path
+import checkpoint
+import reader
+import reducers
+
+# Catalog of the runs under ./output in ./output/catalog.sqlite, for queries
+# across runs without opening their folders:
+#   catalog.query("./output/catalog.sqlite",
+#       "SELECT run, Vf, I_mean FROM segments WHERE pixel=? AND Duty=? AND Vf>=? AND phase='stress'", "R0G6", 0.5, 0.2)
+# Run adds itself when it starts, every completed step (with the summary of its
+# segments, see reducers.py) and its status when it ends. The catalog only
+# repeats what is in the folders, "python catalog.py [output folder]" rebuilds it.
+# Runs are named by their folder below ./output, e.g. "<run>" or, for the parts
+# of a multi-rig run (rigs.py), "<run>/part<j>".
+catalog_name = "catalog.sqlite"
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY, started REAL, status TEXT, output_format TEXT, ispulseused INTEGER,
+    steps_done INTEGER, samples INTEGER, conf TEXT, stats TEXT);
+CREATE TABLE IF NOT EXISTS steps (
+    run TEXT, step INTEGER, Period REAL, Vf REAL, Duty REAL, pixels TEXT,
+    PRIMARY KEY (run, step));
+CREATE TABLE IF NOT EXISTS files (
+    run TEXT, name TEXT, size INTEGER,
+    PRIMARY KEY (run, name));
+CREATE TABLE IF NOT EXISTS segments (
+    run TEXT, pixel TEXT, Period REAL, Vf REAL, Duty REAL, phase TEXT,
+    n INTEGER, V_mean REAL, V_std REAL, I_mean REAL, I_std REAL, I_min REAL, I_max REAL, summary TEXT,
+    PRIMARY KEY (run, pixel, Period, Vf, Duty, phase));
+CREATE INDEX IF NOT EXISTS segments_point ON segments (pixel, Duty, Vf, Period);
+"""
+
+def output_root(folder):
+    # first parent without a conf.json: ./output for ./output/<run> and ./output/<run>/part<j>
+    root = Path(folder).resolve().parent
+    while (root / "conf.json").exists():
+        root = root.parent
+    return root
+
+def run_name(folder, root=None):
+    root = output_root(folder) if root is None else Path(root)
+    return Path(folder).resolve().relative_to(root.resolve()).as_posix()
+
+def db_path(folder):
+    return output_root(folder) / catalog_name
+
+def connect(db):
+    con = sqlite3.connect(str(db), timeout=10)
+    con.executescript(schema)
+    return con
+
+def query(db, sql, *params):
+    con = connect(db)
+    try:
+        return con.execute(sql, params).fetchall()
+    finally:
+        con.close()
+
+def summary_rows(run, summary, summary_file):
+    rows = []
+    for phase, result in summary["phases"].items():
+        row = {"n": None, "V_mean": None, "V_std": None, "I_mean": None, "I_std": None, "I_min": None, "I_max": None}
+        if "welford" in result:
+            w = result["welford"]
+            row.update(n=w["n"], V_mean=w["mean"]["V"], V_std=w["std"]["V"], I_mean=w["mean"]["I"], I_std=w["std"]["I"])
+        elif "blocks" in result:
+            row["n"] = sum(r[2] for r in result["blocks"]["rows"])
+        if "minmax" in result:
+            row.update(I_min=result["minmax"]["min"]["I"], I_max=result["minmax"]["max"]["I"])
+        rows.append((run, summary["pixel"], summary["Period"], summary["Vf"], summary["Duty"], phase,
+                     row["n"], row["V_mean"], row["V_std"], row["I_mean"], row["I_std"], row["I_min"], row["I_max"], summary_file))
+    return rows
+
+def insert_segments(con, run, rows):
+    con.executemany("INSERT OR REPLACE INTO segments VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    con.execute("UPDATE runs SET samples=(SELECT SUM(n) FROM segments WHERE run=?) WHERE run=?", (run, run))
+
+def insert_step(con, run, folder, entry):
+    con.execute("INSERT OR REPLACE INTO steps VALUES (?,?,?,?,?,?)", (run, entry["step"], entry["Period"], entry["Vf"], entry["Duty"], json.dumps(entry["pixels"])))
+    con.executemany("INSERT OR REPLACE INTO files VALUES (?,?,?)", [(run, name, size) for name, size in entry["files"].items()])
+    rows = []
+    for pixel in entry["pixels"]:
+        summary_file = Path(reducers.summary_file(folder, pixel, entry["Period"], entry["Vf"], entry["Duty"]))
+        if summary_file.exists():
+            with open(summary_file) as f:
+                rows += summary_rows(run, json.load(f), summary_file.name)
+    insert_segments(con, run, rows)
+    con.execute("UPDATE runs SET steps_done=(SELECT COUNT(*) FROM steps WHERE run=?) WHERE run=?", (run, run))
+
+def add_run(folder, conf, status="running"):
+    con = connect(db_path(folder))
+    with con:
+        # a resumed run keeps its steps and segments
+        con.execute("INSERT INTO runs (run, started, status, output_format, ispulseused, steps_done, samples, conf) VALUES (?,?,?,?,?,0,0,?) "
+                    "ON CONFLICT (run) DO UPDATE SET status=excluded.status, conf=excluded.conf",
+                    (run_name(folder), time.time(), status, conf.get("output_format", "text"), int(bool(conf.get("ispulseused"))), json.dumps(conf)))
+    con.close()
+
+def add_step(folder, entry):
+    con = connect(db_path(folder))
+    with con:
+        insert_step(con, run_name(folder), folder, entry)
+    con.close()
+
+def finish_run(folder, status, stats=None):
+    con = connect(db_path(folder))
+    with con:
+        con.execute("UPDATE runs SET status=?, stats=? WHERE run=?", (status, json.dumps(stats, default=str), run_name(folder)))
+    con.close()
+
+def index_run(con, run, folder):
+    # everything about one run folder, from what is on disk
+    folder = Path(folder)
+    with open(folder / "conf.json") as f:
+        conf = json.load(f)
+    for table in ("runs", "steps", "files", "segments"):
+        con.execute("DELETE FROM {} WHERE run=?".format(table), (run,))
+    con.execute("INSERT INTO runs (run, started, status, output_format, ispulseused, steps_done, samples, conf) VALUES (?,?,?,?,?,0,0,?)",
+                (run, (folder / "conf.json").stat().st_mtime, "indexed", conf.get("output_format", "text"), int(bool(conf.get("ispulseused"))), json.dumps(conf)))
+    _, entries, _ = checkpoint.load(folder)
+    for entry in entries:
+        insert_step(con, run, folder, entry)
+    if not list(folder.glob("*_summary.json")):
+        # older runs: sample counts of the segments from the data files
+        counts = {}
+        for s in reader.RunFolder(folder).segments:
+            key = (run, s.pixel, s.Period, s.Vf, s.Duty, s.phase)
+            counts[key] = counts.get(key, 0) + s.rows
+        insert_segments(con, run, [key + (n, None, None, None, None, None, None, None) for key, n in counts.items()])
+    elif not entries:
+        for summary_file in sorted(folder.glob("*_summary.json")):
+            with open(summary_file) as f:
+                insert_segments(con, run, summary_rows(run, json.load(f), summary_file.name))
+
+def rebuild(root="./output"):
+    root = Path(root)
+    db = root / catalog_name
+    if db.exists():
+        db.unlink()
+    con = connect(db)
+    for folder in sorted(p.parent for p in root.rglob("conf.json")):
+        try:
+            with open(folder / "conf.json") as f:
+                if "rigs" in json.load(f):
+                    continue   # multi-rig run, its part<j> folders are runs of their own
+            with con:
+                index_run(con, run_name(folder, root), folder)
+        except Exception:
+            print("{}: not indexed".format(folder))
+            print(traceback.format_exc())
+    count = con.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+    con.close()
+    print("Catalog {}: {} runs".format(db, count))
+
+if __name__ == "__main__":
+    rebuild(*sys.argv[1:])
@@ -0,0 +1,61 @@
+import os
+import json
+from pathlib import Path
+
+# Completed sweep steps of a Run are appended to <run folder>/checkpoint.jsonl,
+# one line per plan step together with the size of every output file once the
+# data of the step was flushed. A Run resumed on the folder skips the recorded
+# steps and cuts the output files back to the recorded sizes, which drops
+# whatever the interrupted step had written. The writers fsync the files
+# before the entry is written, so a file shorter than its recorded size is lost
+# data and stops the resume.
+checkpoint_name = "checkpoint.jsonl"
+output_patterns = ["*.txt", "*.bin", "*_index.jsonl"]
+
+def load(folder):
+    # (set of completed step indices, list of completed entries, output file sizes)
+    path = Path(folder) / checkpoint_name
+    entries = []
+    files = {}
+    if not path.exists():
+        return set(), entries, files
+    valid = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break   # last line cut by the interruption
+            if not line.endswith(b"\n"):
+                break
+            entries.append(entry)
+            files = entry["files"]
+            valid += len(line)
+    if path.stat().st_size > valid:
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+    return set(entry["step"] for entry in entries), entries, files
+
+def truncate(folder, files):
+    paths = [path for pattern in output_patterns for path in Path(folder).glob(pattern)]
+    # everything is checked before anything is cut
+    for name, size in files.items():
+        path = Path(folder) / name
+        actual = path.stat().st_size if path.exists() else 0
+        if actual < size:
+            raise Exception("Checkpoint: {} has {} bytes, {} were recorded".format(name, actual, size))
+    for path in paths:
+        size = files.get(path.name, 0)
+        if size == 0:
+            print("Checkpoint: removing {}".format(path.name))
+            path.unlink()
+        elif path.stat().st_size > size:
+            print("Checkpoint: truncating {} to {} bytes".format(path.name, size))
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+def append(folder, entry):
+    with open(Path(folder) / checkpoint_name, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
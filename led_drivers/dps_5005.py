@@ -1,6 +1,9 @@
 import minimalmodbus
 import time
 import csv
+import os
+import ast
+import json
 
 import configparser as ConfigParser
 
@@ -10,23 +13,24 @@ import configparser as ConfigParser
 # these limits prevent the program from issuing silly values.
 # '''
 class Import_limits:
-	def __init__(self, filename):
-		Config = ConfigParser.ConfigParser()
+	sections = ['SectionOne', 'SectionTwo', 'SectionThree']	# safety limits, decimal places, plot colours
+
+	def __init__(self, filename, values=None):
+		if values is None:
+			values = Import_limits.parse(filename)
+		self.values = values
+		for c, v in values.items():
+			setattr(self, c, v)
+
+	@staticmethod
+	def parse(filename):
+		Config = ConfigParser.ConfigParser(inline_comment_prefixes=("#",))
 		Config.read(filename)
-		b = Config.options('SectionOne')		# safety limits
-		for x in range(len(b)):
-			c = b[x]
-			exec("self.%s = %s" % (c, Config.get('SectionOne', c)))	
-		
-		b = Config.options('SectionTwo')		# decimal places
-		for x in range(len(b)):
-			c = b[x]
-			exec("self.%s = %s" % (c, Config.get('SectionTwo', c)))
-		
-		b = Config.options('SectionThree')		# plot colours
-		for x in range(len(b)):
-			c = b[x]
-			exec("self.%s = %s" % (c, Config.get('SectionThree', c)))			
+		values = {}
+		for section in Import_limits.sections:
+			for c in Config.options(section):
+				values[c] = ast.literal_eval(Config.get(section, c))
+		return values
 
 '''
 # original inspiration for this came from here:
@@ -56,10 +60,16 @@ class Serial_modbus:
 		self.instrument.write_registers(reg_addr, value)
 				
 class Dps5005:
+	# registers that hold settings; their last known raw values are cached so that
+	# writing an unchanged value costs no Modbus transaction
+	setpoint_registers = set([0x00, 0x01, 0x06, 0x09, 0x0A, 0x23] + list(range(0x50, 0x58)))
 #--- new ---
 	def __init__(self, ser, limits):
 		self.serial_data = ser
 		self.limits = limits
+		self.registers = {}
+		self.transactions = 0
+		self.skipped = 0
 		
 	def voltage_set(self, RWaction='r', value=0.0):	# R/W
 		return self.function(0x00, self.limits.decimals_vset, RWaction, value, self.limits.voltage_set_max, self.limits.voltage_set_min) # reg_addr, decimal_places, RWaction, value, max_value, min_value 
@@ -156,34 +166,77 @@ class Dps5005:
 	def write_all(self, reg_addr=0, value=0):	# write block
 		self.functions(reg_addr, 0, 'w', value)
 		
+	def set_registers(self, values):	# {reg_addr: raw value}
+		# only changed registers are sent, neighbouring ones in one block write
+		blocks = []
+		for reg_addr in sorted(values):
+			if self.registers.get(reg_addr) == values[reg_addr]:
+				self.skipped += 1
+			elif blocks and blocks[-1][0] + len(blocks[-1][1]) == reg_addr:
+				blocks[-1][1].append(values[reg_addr])
+			else:
+				blocks.append((reg_addr, [values[reg_addr]]))
+		for reg_addr, raw in blocks:
+			if len(raw) == 1:
+				self.write_raw(reg_addr, raw[0])
+			else:
+				self.functions(reg_addr, 0, 'w', raw)
+		return len(blocks)
+
+	def verify(self):	# confirm the cached voltage/current setting and on/off state with one block read
+		expected = {reg_addr: self.registers[reg_addr] for reg_addr in (0x00, 0x01, 0x09) if reg_addr in self.registers}
+		data = self.functions(0x00, 10)
+		if data is False:
+			raise Exception("DPS5005 readback failed")
+		wrong = [reg_addr for reg_addr, raw in expected.items() if data[reg_addr] != raw]
+		if wrong:
+			raise Exception("DPS5005 readback mismatch at registers {}: {}".format(wrong, data[:10]))
+
 #---
+	def write_raw(self, reg_addr, raw):
+		self.transactions += 1
+		try:
+			self.serial_data.write(reg_addr, raw, 0)
+			self.registers[reg_addr] = raw
+		except IOError:
+			self.registers.pop(reg_addr, None)
+			print("Failed to write to instrument")
+
 	def function(self, reg_addr=0, decimal_places=0, RWaction='r', value=0.0, max_value=0, min_value=0):
 		a = False
 		if value > max_value or value < min_value: 
 			value = 0.0
 		if RWaction != 'w':
+			self.transactions += 1
 			try:
 				a = self.serial_data.read(reg_addr, decimal_places)
+				if reg_addr in self.setpoint_registers:
+					self.registers[reg_addr] = int(round(a * 10**decimal_places))
 			except IOError:
 				print("Failed to read from instrument")
 		else:
-			try:
-				self.serial_data.write(reg_addr, value, decimal_places) # register, value, No_of_decimal_places
-			except IOError:
-				print("Failed to write to instrument")
+			self.set_registers({reg_addr: int(round(value * 10**decimal_places))})
 		return(a)
 	
 	def functions(self, reg_addr=0, num_of_addr=0, RWaction='r', value=0):
 		a = False
+		self.transactions += 1
 		if RWaction != 'w':
 			try:
 				a = self.serial_data.read_block(reg_addr, num_of_addr)
+				for k, raw in enumerate(a):
+					if reg_addr + k in self.setpoint_registers:
+						self.registers[reg_addr + k] = raw
 			except IOError:
 				print("Failed to read block from instrument")
 		else:
 			try:
 				self.serial_data.write_block(reg_addr, value)
+				for k, raw in enumerate(value):
+					self.registers[reg_addr + k] = int(raw)
 			except IOError:
+				for k in range(len(value)):
+					self.registers.pop(reg_addr + k, None)
 				print("Failed to write block to instrument")
 		return(a)
 	
@@ -232,32 +285,104 @@ class Dps5005:
 			print("Failed to load file.")
 
 class LED:
+	readback = False	# confirm every setCurrent with one block read (led_readback in the run configuration)
+	limits_file = "./led_drivers/dps5005_limits.ini"
+	# per port: the output voltage setting found by the search, the input voltage
+	# it was found at and the parsed limits file
+	cache_file = "./led_drivers/dps5005_cache.json"
+
 	def __init__(self, port) -> None:
 		print("LED connecting...")
-		self.ser = Serial_modbus(port, 1, 9600, 8)
-		self.limits = Import_limits("./led_drivers/dps5005_limits.ini")
+		self.port = port
+		self.ser = self.open_serial(port)
+		cache = self.load_cache()
+		entry = cache.get(port, {})
+		mtime = os.path.getmtime(self.limits_file)
+		if entry.get("limits_mtime") == mtime:
+			self.limits = Import_limits(self.limits_file, entry["limits"])
+		else:
+			self.limits = Import_limits(self.limits_file)
 		self.dps = Dps5005(self.ser, self.limits)
-		time.sleep(1)
-		input_volt = self.dps.voltage_in()
+		state = self.dps.functions(0x00, 10)	# V/I set, readings, input voltage and on/off
+		if state is False:
+			time.sleep(1)	# the supply may still be starting up
+			state = self.dps.functions(0x00, 10)
+		assert state is not False, "No LED responce"
+		check = self.apply_cached_voltage(entry, state)
+		if check is None:
+			check = self.search_voltage(state[5] / float(10**self.limits.decimals_vin))
+			entry = {"voltage_set": self.dps.registers[0x00], "voltage_in": state[5]}
+		print("LED voltage: ", check)
+		cache[port] = dict(entry, limits_mtime=mtime, limits=self.limits.values)
+		self.save_cache(cache)
+		# self.dps.current_set('w', 1e-3)
+		self.dps.current_set('w',0)
+		self.dps.onoff('w', 1)
+		# print(self.dps.read_all())
+		print("LED connected")
+
+	def apply_cached_voltage(self, entry, state):
+		# the voltage found last time is valid as long as the input voltage is the same
+		if entry.get("voltage_in") != state[5] or not entry.get("voltage_set"):
+			return None
+		if state[0] != entry["voltage_set"]:
+			self.dps.set_registers({0x00: entry["voltage_set"]})
+			if self.dps.functions(0x00, 1) != [entry["voltage_set"]]:
+				print("LED cached voltage rejected, searching")
+				return None
+		return entry["voltage_set"] / float(10**self.limits.decimals_vset)
+
+	def search_voltage(self, input_volt):
+		# highest setting the supply accepts, stepping down 1 V from the input voltage
 		while input_volt > 0:
 			self.dps.voltage_set('w', input_volt)
 			check = self.dps.voltage_set('r')
 			if abs(check - input_volt) < 1: break
 			input_volt -= 1
-		print("LED voltage: ", check)
 		assert input_volt > 0, "Failed to set LED voltage"
-		# self.dps.current_set('w', 1e-3)
-		self.dps.current_set('w',0)
+		return check
+
+	def load_cache(self):
+		try:
+			with open(self.cache_file) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	def save_cache(self, cache):
+		tmp = "{}.{}.tmp".format(self.cache_file, os.getpid())	# rigs may start in parallel processes
+		try:
+			with open(tmp, "w") as f:
+				json.dump(cache, f, indent=4)
+			os.replace(tmp, self.cache_file)
+		except OSError:
+			print("Failed to save LED cache")
+
+	def open_serial(self, port):
+		return Serial_modbus(port, 1, 9600, 8)
+
+	# session pool, see sessions.py
+	def check(self):
+		return self.dps.functions(0x00, 10) is not False	# also refreshes the register cache
+
+	def park(self):
+		self.dps.current_set('w', 0)
+		self.dps.onoff('w', 0)
+		print("LED parked: {} Modbus transactions, {} writes skipped".format(self.dps.transactions, self.dps.skipped))
+
+	def resume(self):
+		self.dps.transactions = 0
+		self.dps.skipped = 0
 		self.dps.onoff('w', 1)
-		# print(self.dps.read_all())
-		print("LED connected")
 	def setCurrent(self, i):
 		self.dps.current_set('w', i)
+		if self.readback:
+			self.dps.verify()
 		# print(self.dps.read_all())
 	def disconnect(self):
 		self.dps.onoff('w', 0)
 		self.ser.instrument.serial.close()
-		print("LED disconnected")
+		print("LED disconnected: {} Modbus transactions, {} writes skipped".format(self.dps.transactions, self.dps.skipped))
 		# print("Apply LED I:",i)
 # '''
 # This file can operate independently controlling the DPS via the commandline however the GUI is much simpler.
@@ -0,0 +1,13 @@
+import simulators
+
+# dps_5005 talking to a simulated DPS5005 register map instead of Modbus RTU.
+# led_port selects the link options, e.g. "sim?latency=0.004&bandwidth=960"
+base = simulators.load_driver("led_drivers", "dps_5005")
+
+class Serial_sim(base.Serial_modbus):
+	def __init__(self, port):
+		self.instrument = simulators.SimDps5005(port)
+
+class LED(base.LED):
+	def open_serial(self, port):
+		return Serial_sim(port)
@@ -0,0 +1,132 @@
+import traceback
+import collections
+import threading as T
+import numpy as np
+
+# Live view of the measured signal. The acquisition loop only appends a
+# reference to every block (V, I, T columns) to a ring buffer; a consumer
+# thread wakes up <rate> times per second, reduces the new blocks to a min/max
+# envelope of at most <points> buckets per pixel and passes one update per
+# changed pixel to every subscriber:
+#   {"pixel": name, "index": pixel index, "new": first update of this segment,
+#    "t": bucket start times, "v_min", "v_max", "i_min", "i_max": bucket envelopes}
+# If the consumer falls behind, the oldest blocks are dropped from the ring.
+# The pulse SMU restarts its TIME column with every block, so a block whose
+# times start before the end of the previous one of the segment is moved to
+# follow it: the time axis of a segment keeps increasing.
+
+def envelope(t, lo, hi, points):
+    # merge neighbouring buckets until there are at most <points> of them
+    if len(t) <= points:
+        return t, lo, hi
+    factor = -(-len(t) // points)
+    pad = -len(t) % factor
+    if pad:
+        t = np.concatenate([t, np.full(pad, t[-1])])
+        lo = np.concatenate([lo, np.repeat(lo[-1:], pad, axis=0)])
+        hi = np.concatenate([hi, np.repeat(hi[-1:], pad, axis=0)])
+    t = t.reshape(-1, factor)[:,0]
+    lo = lo.reshape(-1, factor, lo.shape[1]).min(axis=1)
+    hi = hi.reshape(-1, factor, hi.shape[1]).max(axis=1)
+    return t, lo, hi
+
+def decimate(block, points):
+    # (t, min, max) of the V and I columns in at most <points> buckets
+    n = len(block)
+    size = -(-n // points)
+    full = n // size * size
+    buckets = block[:full].reshape(-1, size, block.shape[1])
+    t = buckets[:,0,2]
+    lo = buckets[:,:,:2].min(axis=1)
+    hi = buckets[:,:,:2].max(axis=1)
+    if full < n:
+        rest = block[full:]
+        t = np.append(t, rest[0,2])
+        lo = np.vstack([lo, rest[:,:2].min(axis=0)])
+        hi = np.vstack([hi, rest[:,:2].max(axis=0)])
+    return t, lo, hi
+
+class LiveView:
+    def __init__(self, rate=5, points=500, ring_size=64) -> None:
+        self.rate = rate
+        self.points = points
+        self.ring = collections.deque(maxlen=ring_size)
+        self.subscribers = []
+        self.segments = {}   # pixel -> (segment number, pixel index)
+        self.clocks = {}     # pixel -> (time offset, end time) of the current segment
+        self.traces = {}
+        self.pushed = 0
+        self.dropped = 0
+        self.updates = 0
+        self.thread = None
+        self.stop_event = T.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def begin(self, pixel, index):
+        # a new segment of a pixel starts, its trace is cleared
+        segment = self.segments.get(pixel, (0, index))[0] + 1
+        self.segments[pixel] = (segment, index)
+        self.clocks.pop(pixel, None)
+
+    def push(self, pixel, data):
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+        offset = 0.0
+        if len(data):
+            offset, end = self.clocks.get(pixel, (0.0, None))
+            if end is not None and data[0][2] + offset < end:
+                offset = end   # the TIME column restarted
+            self.clocks[pixel] = (offset, data[-1][2] + offset)
+        self.ring.append((pixel, self.segments[pixel], offset, data))
+        self.pushed += 1
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = T.Thread(target=self.consume, daemon=True)
+        self.thread.start()
+
+    def consume(self):
+        while not self.stop_event.wait(1 / self.rate):
+            self.update()
+        self.update()
+
+    def update(self):
+        changed = {}
+        while self.ring:
+            pixel, (segment, index), offset, data = self.ring.popleft()
+            block = np.asarray(data, dtype=float).reshape(-1, 3)
+            if len(block) == 0:
+                continue
+            t, lo, hi = decimate(block, self.points)
+            t = t + offset
+            trace = self.traces.get(pixel)
+            if trace is None or trace["segment"] != segment:
+                trace = {"segment": segment, "index": index, "new": True, "t": t, "lo": lo, "hi": hi}
+                self.traces[pixel] = trace
+            else:
+                trace["t"], trace["lo"], trace["hi"] = envelope(np.concatenate([trace["t"], t]), np.vstack([trace["lo"], lo]), np.vstack([trace["hi"], hi]), self.points)
+            changed[pixel] = trace
+        for pixel, trace in changed.items():
+            update = {"pixel": pixel, "index": trace["index"], "new": trace["new"], "t": trace["t"],
+                      "v_min": trace["lo"][:,0], "v_max": trace["hi"][:,0], "i_min": trace["lo"][:,1], "i_max": trace["hi"][:,1]}
+            trace["new"] = False
+            self.updates += 1
+            for callback in list(self.subscribers):
+                try:
+                    callback(update)
+                except Exception:
+                    print(traceback.format_exc())
+
+    def close(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        return {"pushed": self.pushed, "dropped": self.dropped, "updates": self.updates}
@@ -1,5 +1,6 @@
 # import eel
 import Run
+import rigs
 import numpy as np
 
 run = None
@@ -8,26 +9,30 @@ def start_run(configuration):
     print("Start run")
     global run
     if (run is None) or (not run.is_alive()):
-        run = Run.Run()
+        # a "rigs" list splits the sweep between several instrument sets
+        run = rigs.MultiRun() if "rigs" in configuration else Run.Run()
         run.start_run(configuration)
         return "ok"
     else:
         return "Thread is alredy alive"
 
-import json
+# rigs.MultiRun starts its rigs with spawn, which imports this file again:
+# nothing below may run in those processes.
+if __name__ == "__main__":
+    import json
  
-# Opening JSON file
-# with open('conf.json') as json_file:
-#     conf = json.load(json_file)
-with open('conf_pulse.json') as json_file:
-    conf = json.load(json_file)
-conf["ispulseused"] = True
+    # Opening JSON file
+    # with open('conf.json') as json_file:
+    #     conf = json.load(json_file)
+    with open('conf_pulse.json') as json_file:
+        conf = json.load(json_file)
+    conf["ispulseused"] = True
 
-conf["Vr_prof"] = -0.5  # Referce voltage
-conf["Vf_prof_arr"] = np.arange(0,0.1,0.25).tolist()  # Array of forward voltages. Generate array from 0 to 1 (incl) with 0.25 step
-conf["Duty_cycles"] = [0.1,0.25,0.5,0.75] # Array of duty cycles (D). D = Tr / Period. Tr - time for reverse voltage, Period = 100 ms?
-conf["smu_periods_arr"] = [0.1,0.2,0.3]
+    conf["Vr_prof"] = -0.5  # Referce voltage
+    conf["Vf_prof_arr"] = np.arange(0,0.1,0.25).tolist()  # Array of forward voltages. Generate array from 0 to 1 (incl) with 0.25 step
+    conf["Duty_cycles"] = [0.1,0.25,0.5,0.75] # Array of duty cycles (D). D = Tr / Period. Tr - time for reverse voltage, Period = 100 ms?
+    conf["smu_periods_arr"] = [0.1,0.2,0.3]
 
-start_run(conf)
-run.join()
-print("Main thread exit")
\ No newline at end of file
+    start_run(conf)
+    run.join()
+    print("Main thread exit")
\ No newline at end of file
@@ -0,0 +1,137 @@
+import json
+import itertools
+
+# Expands the sweep of a configuration into an explicit list of steps and picks
+# the loop order. A step is one Period/Vf/Duty point for one pixel (or one pixel
+# group when several smu_channels are used).
+#
+# Configuration keys:
+#   plan_order       - "legacy" (Period > Vf > Duty > pixel, the default), "auto",
+#                      or an explicit list of the loop keys, outermost first
+#   plan_constraints - for "auto": [outer, inner] pairs that must stay nested,
+#                      e.g. [["Period", "Duty"]]
+#   plan_serpentine  - also try every order with the inner loops running back
+#                      and forth (see expand); by default only for "auto"
+#   plan_costs       - seconds per relay switch, LED write and SMU command used
+#                      by the cost model and the time estimate
+loop_keys = ["Period", "Vf", "Duty", "pixel"]
+legacy_order = ["Period", "Vf", "Duty", "pixel"]
+default_costs = {"relay": 0.01, "led": 0.03, "smu_command": 0.01}
+
+def pixel_groups(pixels, size):
+    # Pixels measured together, one per SMU channel. The LED has a single current,
+    # so only consecutive pixels with the same current share a group.
+    groups = []
+    for pixel in pixels:
+        if groups and len(groups[-1]) < size and groups[-1][0]["curr"] == pixel["curr"]:
+            groups[-1].append(pixel)
+        else:
+            groups.append([pixel])
+    return groups
+
+def pulse_conf(conf, Period, Vf_prof, Duty_cycle):
+    # SMU parameters of the stress phase of one sweep point
+    Tf = (1-Duty_cycle) * Period
+    current_conf = dict(conf["smu_custom_pars"])
+    current_conf["pulsevoltage"] = {"value": Vf_prof}
+    current_conf["basevoltage"] = {"value": conf["Vr_prof"]}
+    current_conf["pulsewidth"] = {"value": Tf}
+    current_conf["pulsedelay"] = {"value": Period - Tf}
+    return current_conf
+
+def loop_values(conf):
+    pixels = conf["pixel_loop"]["loop"]
+    channels = conf.get("smu_channels", [])
+    if conf["ispulseused"] and len(channels) > 1:
+        units = pixel_groups(pixels, len(channels))
+    else:
+        units = [[pixel] for pixel in pixels]
+    return {"Period": conf["smu_periods_arr"], "Vf": conf["Vf_prof_arr"], "Duty": conf["Duty_cycles"], "pixel": units}
+
+def expand(values, order, serpentine=False):
+    # nested loops over the indices of values, outermost key first; with serpentine
+    # every inner loop runs backwards on every other pass, so neighbouring steps
+    # share the value at the turn
+    steps = []
+    passes = [0] * len(order)
+    def loop(level, step):
+        if level == len(order):
+            steps.append(dict(step))
+            return
+        key = order[level]
+        indices = range(len(values[key]))
+        if serpentine and passes[level] % 2 == 1:
+            indices = reversed(indices)
+        passes[level] += 1
+        for i in indices:
+            step[key] = i
+            loop(level + 1, step)
+    loop(0, {})
+    return steps
+
+def step_values(values, step):
+    return values["Period"][step["Period"]], values["Vf"][step["Vf"]], values["Duty"][step["Duty"]], values["pixel"][step["pixel"]]
+
+def estimate(conf, values, steps):
+    costs = dict(default_costs, **conf.get("plan_costs", {}))
+    counts = {"relay_switches": 0, "led_writes": 0, "smu_commands": 0}
+    prev_pin = None
+    prev_curr = None
+    smu_state = {k: v["value"] for k, v in conf["smu_custom_pars"].items()}
+    recovery = {k: v["value"] for k, v in conf.get("smu_custom_pars_rec", {}).items()}
+    for step in steps:
+        Period, Vf_prof, Duty_cycle, pixels = step_values(values, step)
+        pin = ",".join(pixel["ext"] + pixel["inn"] for pixel in pixels)
+        if pin != prev_pin:
+            counts["relay_switches"] += 1
+            prev_pin = pin
+        if pixels[0]["curr"] != prev_curr:
+            counts["led_writes"] += 1
+            prev_curr = pixels[0]["curr"]
+        if conf["ispulseused"]:
+            for state in [{k: v["value"] for k, v in pulse_conf(conf, Period, Vf_prof, Duty_cycle).items()}, recovery]:
+                counts["smu_commands"] += sum(1 for k, v in state.items() if smu_state.get(k) != v) * len(pixels)
+                smu_state.update(state)
+    measure_time = len(steps) * (conf["smu_t_total"] + conf["smu_t_total_rec"])
+    switch_time = counts["relay_switches"] * (costs["relay"] + conf["comm_relay_delay"] / 1000) + counts["led_writes"] * costs["led"] + counts["smu_commands"] * costs["smu_command"]
+    return dict(counts, measure_time=measure_time, switch_time=switch_time, total_time=measure_time + switch_time)
+
+def candidate_orders(conf):
+    order = conf.get("plan_order", "legacy")
+    if order == "legacy":
+        return [legacy_order]
+    if order != "auto":
+        assert sorted(order) == sorted(loop_keys), "plan_order must list {}".format(loop_keys)
+        return [list(order)]
+    constraints = conf.get("plan_constraints", [])
+    orders = []
+    for order in itertools.permutations(legacy_order):
+        if all(order.index(outer) < order.index(inner) for outer, inner in constraints):
+            orders.append(list(order))
+    assert orders, "plan_constraints cannot be satisfied"
+    return orders
+
+def make_plan(conf):
+    values = loop_values(conf)
+    best = None
+    serpentines = [False, True] if conf.get("plan_serpentine", conf.get("plan_order", "legacy") == "auto") else [False]
+    for order in candidate_orders(conf):
+        for serpentine in serpentines:
+            steps = expand(values, order, serpentine)
+            cost = estimate(conf, values, steps)
+            if best is None or cost["switch_time"] < best["estimate"]["switch_time"]:
+                best = {"order": order, "serpentine": serpentine, "estimate": cost, "steps": steps}
+    best["legacy_estimate"] = estimate(conf, values, expand(values, legacy_order))
+    return best
+
+def plan_steps(conf, plan):
+    # (Period, Vf, Duty, pixels) for every step of the plan
+    values = loop_values(conf)
+    return [step_values(values, step) for step in plan["steps"]]
+
+def save_plan(conf, plan, folder):
+    steps = []
+    for step, (Period, Vf_prof, Duty_cycle, pixels) in zip(plan["steps"], plan_steps(conf, plan)):
+        steps.append({"Period": Period, "Vf": Vf_prof, "Duty": Duty_cycle, "pixels": [pixel["ext"] + pixel["inn"] for pixel in pixels], "index": step})
+    with open("{}/plan.json".format(folder), "w") as write_file:
+        json.dump(dict(plan, steps=steps), write_file, indent=4)
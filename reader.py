@@ -0,0 +1,214 @@
+import os
+import re
+import json
+from pathlib import Path
+import numpy as np
+
+# Read access to a Run output folder without parsing it by hand:
+#   run = reader.RunFolder("./output/2024-...")
+#   for seg in run.select(pixel="R0G6", Duty=0.5, phase="stress"):
+#       data = seg.load(t_min=10, t_max=20)   # rows of V, I, T
+# The folder of a multi-rig run (rigs.py) gives the segments of all its
+# part<j> folders, Segment.rig tells which rig finished the part.
+# Segments are indexed from the file names / data_index.jsonl and the saved
+# conf.json; their data is only read when asked for. Binary output is memory
+# mapped from data.bin. Text files are split at the #pixel_time headers (a
+# "#phase <name>" line before a header gives its phase, older files without it
+# have stress and recovery in one "stress" segment) and converted once to
+# <folder>/reader_cache/<file>.npy, which is memory mapped from then on and
+# rebuilt when the text file changes.
+columns = ["V", "I", "T"]
+cache_folder = "reader_cache"
+text_pattern = re.compile(r"^(?P<pixel>.+)_TimeStep-(?P<Period>[^_]+)_Vf-(?P<Vf>[^_]+)_Duty-(?P<Duty>[^_]+)\.txt$")
+header = "#pixel_time"
+phase_marker = "#phase "
+chunk_rows = 65536
+
+class Segment:
+    rig = None
+
+    def __init__(self, run, pixel, Period, Vf, Duty, phase, number, file, start, rows) -> None:
+        self.run = run
+        self.pixel = pixel
+        self.Period = Period
+        self.Vf = Vf
+        self.Duty = Duty
+        self.phase = phase
+        self.number = number    # n-th segment of the file
+        self.file = file
+        self.start = start      # first row in the (cached) binary file
+        self.rows = rows
+
+    def __repr__(self):
+        return "Segment({} Period={} Vf={} Duty={} {} #{}, {} rows)".format(self.pixel, self.Period, self.Vf, self.Duty, self.phase, self.number, self.rows)
+
+    @property
+    def data(self):
+        # (rows, 3) V, I, T, memory mapped
+        return self.run.rows(self.file)[self.start:self.start + self.rows]
+
+    def load(self, t_min=None, t_max=None):
+        data = self.data
+        if t_min is None and t_max is None:
+            return data
+        t = data[:,2]
+        keep = np.ones(len(t), dtype=bool)
+        if t_min is not None:
+            keep &= t >= t_min
+        if t_max is not None:
+            keep &= t <= t_max
+        return data[keep]
+
+def scan_text(path):
+    # [phase, rows] of every segment of a text output file, counted without parsing
+    segments = []
+    phase = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                if line.startswith(phase_marker):
+                    phase = line[len(phase_marker):].strip()
+                elif line.startswith(header):
+                    segments.append([phase or "stress", 0])
+                    phase = None
+            elif segments and line.endswith("\n"):   # a line cut by an interruption is left out
+                segments[-1][1] += 1
+    return segments
+
+def convert_text(path, cache):
+    # text output file -> <cache> (.npy of V, I, T rows), list of (phase, start row, rows).
+    # Parsed chunk_rows lines at a time into the memory mapped .npy, so memory use
+    # does not grow with the file.
+    segments = scan_text(path)
+    total = sum(rows for _, rows in segments)
+    if total == 0:
+        np.save(cache, np.zeros((0, len(columns))))
+    else:
+        out = np.lib.format.open_memmap(cache, mode="w+", dtype="<f8", shape=(total, len(columns)))
+        row = 0
+        lines = []
+        def flush():
+            nonlocal row
+            values = np.fromstring("".join(lines), sep=" ")
+            if len(values) != 3 * len(lines):
+                raise Exception("{}: invalid data line after row {}".format(path, row))
+            values = values.reshape(-1, 3)
+            out[row:row + len(values)] = values[:,[1, 2, 0]]   # file has T, V, I
+            row += len(values)
+            lines.clear()
+        started = False
+        with open(path) as f:
+            for line in f:
+                if line.startswith("#"):
+                    started = started or line.startswith(header)
+                elif started and line.endswith("\n"):
+                    lines.append(line)
+                    if len(lines) >= chunk_rows:
+                        flush()
+        if lines:
+            flush()
+        out.flush()
+        del out
+    result = []
+    start = 0
+    for phase, rows in segments:
+        result.append((phase, start, rows))
+        start += rows
+    return result
+
+class RunFolder:
+    def __init__(self, folder) -> None:
+        self.folder = Path(folder)
+        with open(self.folder / "conf.json") as f:
+            self.conf = json.load(f)
+        self.pixel_index = dict((p["ext"] + p["inn"], i) for i, p in enumerate(self.conf["pixel_loop"]["loop"]))
+        self.mapped = {}
+        self.segments = []
+        self.parts = []
+        if "rigs" in self.conf:
+            parts = []
+            if (self.folder / "progress.json").exists():
+                with open(self.folder / "progress.json") as f:
+                    parts = json.load(f)["parts"]
+            for conf_file in sorted(self.folder.glob("part*/conf.json"), key=lambda path: int(path.parent.name[len("part"):])):
+                part = RunFolder(conf_file.parent)
+                j = int(conf_file.parent.name[len("part"):])
+                rig = parts[j]["rig"] if j < len(parts) else part.conf.get("rig")
+                for segment in part.segments:
+                    segment.rig = rig
+                self.parts.append(part)
+                self.segments.extend(part.segments)
+            return
+        for index in sorted(self.folder.glob("*_index.jsonl")):
+            self.index_binary(index)
+        for path in sorted(self.folder.glob("*.txt")):
+            if text_pattern.match(path.name):
+                self.index_text(path)
+
+    def index_binary(self, index):
+        data_file = self.folder / (index.name[:-len("_index.jsonl")] + ".bin")
+        size = os.path.getsize(data_file)
+        segments = {}
+        with open(index) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                chunk = json.loads(line)
+                if chunk["offset"] + chunk["rows"] * chunk["cols"] * 8 > size:
+                    break
+                key = (chunk["segment"], chunk["phase"])
+                if key not in segments:
+                    row = chunk["offset"] // (chunk["cols"] * 8)
+                    segments[key] = Segment(self, chunk["pixel"], chunk["Period"], chunk["Vf"], chunk["Duty"], chunk["phase"], chunk["segment"], data_file, row, 0)
+                segment = segments[key]
+                if chunk["offset"] != (segment.start + segment.rows) * chunk["cols"] * 8:
+                    raise Exception("{}: chunks of segment {} are not contiguous".format(index, chunk["segment"]))
+                segment.rows += chunk["rows"]
+        self.segments.extend(segments.values())
+
+    def index_text(self, path):
+        cache = self.folder / cache_folder / (path.name + ".npy")
+        meta_file = self.folder / cache_folder / (path.name + ".json")
+        stat = os.stat(path)
+        meta = None
+        if meta_file.exists():
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if meta["size"] != stat.st_size or meta["mtime"] != stat.st_mtime:
+                meta = None
+        if meta is None:
+            os.makedirs(cache.parent, exist_ok=True)
+            segments = convert_text(path, cache)
+            meta = {"size": stat.st_size, "mtime": stat.st_mtime, "segments": segments}
+            with open(meta_file, "w") as f:
+                json.dump(meta, f)
+        m = text_pattern.match(path.name)
+        for number, (phase, start, rows) in enumerate(meta["segments"]):
+            self.segments.append(Segment(self, m["pixel"], float(m["Period"]), float(m["Vf"]), float(m["Duty"]), phase, number, cache, start, rows))
+
+    def rows(self, file):
+        if file not in self.mapped:
+            if file.suffix == ".npy":
+                self.mapped[file] = np.load(file, mmap_mode="r")
+            else:
+                # whole rows only, the last chunk may be cut by an interruption
+                rows = os.path.getsize(file) // (8 * len(columns))
+                self.mapped[file] = np.memmap(file, dtype="<f8", mode="r", shape=(rows, len(columns))) if rows else np.zeros((0, len(columns)))
+        return self.mapped[file]
+
+    def select(self, pixel=None, Period=None, Vf=None, Duty=None, phase=None, rig=None):
+        # segments matching every given value; a list or tuple matches any of its values
+        def match(value, wanted):
+            if wanted is None:
+                return True
+            if isinstance(wanted, (list, tuple, set)):
+                return any(match(value, w) for w in wanted)
+            if isinstance(wanted, float) or isinstance(value, float):
+                return np.isclose(float(value), float(wanted))
+            return value == wanted
+        return [s for s in self.segments if match(s.pixel, pixel) and match(s.Period, Period) and match(s.Vf, Vf) and match(s.Duty, Duty) and match(s.phase, phase) and match(s.rig, rig)]
+
+    def load(self, t_min=None, t_max=None, **selection):
+        # rows of all selected segments in index order
+        parts = [s.load(t_min, t_max) for s in self.select(**selection)]
+        return np.concatenate(parts) if parts else np.zeros((0, len(columns)))
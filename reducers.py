@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import numpy as np
+
+# In-flight reduction of the measured blocks (V, I, T columns). Every segment
+# (pixel, Period, Vf, Duty) gets <pixel>_TimeStep-<Period>_Vf-<Vf>_Duty-<Duty>_summary.json
+# next to the raw data, with the result of every reducer per phase (stress,
+# recovery). Reducers are listed by name in "reducers" of the configuration;
+# custom ones are added to registry. A reducer has:
+#   update(block) - called once per block
+#   result()      - JSON serialisable summary of the phase
+# A segmented SMU (PCB_board) also passes the statistics of every record it
+# decoded; they are kept per phase as "records": {"columns": [...], "rows": [...]}.
+columns = ["V", "I"]
+
+class Welford:
+    # streaming count, mean and variance of V and I, merged block by block
+    def __init__(self, conf) -> None:
+        self.n = 0
+        self.mean = np.zeros(len(columns))
+        self.m2 = np.zeros(len(columns))
+
+    def update(self, block):
+        x = block[:,:len(columns)]
+        n = len(x)
+        mean = x.mean(axis=0)
+        m2 = ((x - mean) ** 2).sum(axis=0)
+        delta = mean - self.mean
+        total = self.n + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    def result(self):
+        var = self.m2 / (self.n - 1) if self.n > 1 else np.full(len(columns), np.nan)
+        return {"n": self.n, "mean": dict(zip(columns, self.mean.tolist())), "var": dict(zip(columns, var.tolist())), "std": dict(zip(columns, np.sqrt(var).tolist()))}
+
+class MinMax:
+    def __init__(self, conf) -> None:
+        self.min = np.full(len(columns), np.inf)
+        self.max = np.full(len(columns), -np.inf)
+
+    def update(self, block):
+        x = block[:,:len(columns)]
+        np.minimum(self.min, x.min(axis=0), out=self.min)
+        np.maximum(self.max, x.max(axis=0), out=self.max)
+
+    def result(self):
+        return {"min": dict(zip(columns, self.min.tolist())), "max": dict(zip(columns, self.max.tolist()))}
+
+class Percentiles:
+    # percentiles of the last <reducer_window> samples, after every block and at the end
+    q = [5, 50, 95]
+
+    def __init__(self, conf) -> None:
+        self.window_size = conf.get("reducer_window", 10000)
+        self.window = np.empty((0, len(columns)))
+        self.history = []
+
+    def update(self, block):
+        self.window = np.concatenate([self.window, block[-self.window_size:,:len(columns)]])[-self.window_size:]
+        self.history.append([float(block[-1,2])] + np.percentile(self.window[:,1], self.q).tolist())
+
+    def result(self):
+        p = np.percentile(self.window, self.q, axis=0) if len(self.window) else np.full((len(self.q), len(columns)), np.nan)
+        return {"window": self.window_size, "q": self.q, "V": p[:,0].tolist(), "I": p[:,1].tolist(),
+                "history_columns": ["T"] + ["I_p{}".format(q) for q in self.q], "history": self.history}
+
+class BlockTable:
+    # one row per block
+    table_columns = ["T_start", "T_end", "n", "V_mean", "I_mean", "I_std", "I_min", "I_max"]
+
+    def __init__(self, conf) -> None:
+        self.rows = []
+
+    def update(self, block):
+        i = block[:,1]
+        self.rows.append([float(block[0,2]), float(block[-1,2]), len(block), float(block[:,0].mean()), float(i.mean()), float(i.std()), float(i.min()), float(i.max())])
+
+    def result(self):
+        return {"columns": self.table_columns, "rows": self.rows}
+
+registry = {
+    "welford": Welford,
+    "minmax": MinMax,
+    "percentiles": Percentiles,
+    "blocks": BlockTable,
+}
+default_reducers = ["welford", "minmax", "percentiles", "blocks"]
+
+def summary_file(outputfolder, name, Period, Vf, Duty):
+    # summary of the segment of pixel <name> (ext + inn) at one sweep point
+    return "{}/{}_TimeStep-{}_Vf-{}_Duty-{}_summary.json".format(outputfolder, name, Period, Vf, Duty)
+
+class Stage:
+    row_buffer_size = 4096
+
+    def __init__(self, conf, outputfolder) -> None:
+        self.conf = conf
+        self.outputfolder = outputfolder
+        self.names = conf.get("reducers", default_reducers)
+        for name in self.names:
+            if name not in registry:
+                raise Exception("Unknown reducer: {}".format(name))
+        self.key = None
+        self.row_buffer = []
+        self.reduce_time = 0.0
+
+    def filename(self, pixel, Period, Vf, Duty):
+        return summary_file(self.outputfolder, pixel["ext"] + pixel["inn"], Period, Vf, Duty)
+
+    def begin(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.key = {"pixel": pixel["ext"] + pixel["inn"], "Period": Period, "Vf": Vf, "Duty": Duty}
+        self.file = self.filename(pixel, Period, Vf, Duty)
+        self.phases = {}
+        self.records = {}
+        self.set_phase(phase)
+
+    def set_phase(self, phase):
+        self.flush_rows()
+        self.phase = phase
+        self.reducers = self.phases.setdefault(phase, dict((name, registry[name](self.conf)) for name in self.names))
+
+    def update(self, data):
+        start = time.perf_counter()
+        block = np.asarray(data, dtype=float)
+        if block.ndim == 2 and block.shape[0] > 0:
+            for reducer in self.reducers.values():
+                reducer.update(block)
+        self.reduce_time += time.perf_counter() - start
+
+    def add_records(self, records):
+        self.record_columns = list(records.dtype.names)
+        self.records.setdefault(self.phase, []).extend(records.tolist())
+
+    def add_row(self, t, v, i):
+        # DC samples are reduced in blocks of row_buffer_size
+        self.row_buffer.append((v, i, t))
+        if len(self.row_buffer) >= self.row_buffer_size:
+            self.flush_rows()
+
+    def flush_rows(self):
+        if self.row_buffer:
+            rows, self.row_buffer = self.row_buffer, []
+            self.update(rows)
+
+    def end(self):
+        if self.key is None:
+            return
+        self.flush_rows()
+        summary = dict(self.key, phases=dict((phase, dict((name, reducer.result()) for name, reducer in reducers.items())) for phase, reducers in self.phases.items()))
+        for phase, rows in self.records.items():
+            summary["phases"][phase]["records"] = {"columns": self.record_columns, "rows": rows}
+        with open(self.file + ".tmp", "w") as f:
+            json.dump(summary, f)
+        # replaced at once, a resumed step rewrites it
+        os.replace(self.file + ".tmp", self.file)
+        self.key = None
@@ -0,0 +1,186 @@
+import json
+import queue
+import traceback
+import threading as T
+import multiprocessing as mp
+from pathlib import Path
+from datetime import datetime
+import Run
+import planner
+
+# Runs one sweep on several identical rigs at once. The configuration gets a
+# "rigs" list; every entry overrides the instrument keys of the sweep for one rig:
+#   "rigs": [{"smu_port": "...", "led_port": "COM4", "comm_port": "COM3"}, ...]
+# "rig_split" names the list that is divided into parts: "pixel_loop" (default,
+# one part per pixel or pixel group), "smu_periods_arr", "Vf_prof_arr" or
+# "Duty_cycles" (one part per value). All parts go into one queue; every rig
+# runs in its own process and takes the next part as soon as it is free, so a
+# slow rig takes fewer parts. Every part is a Run of its own in
+# <run folder>/part<j>, with the rig that started it as "rig" in its conf.json.
+# A rig that fails stops taking parts; the part it was on goes back to the
+# queue and another rig resumes it from its checkpoint. The run folder gets the
+# full conf.json and a merged progress.json.
+# The rig processes are started with spawn, which imports the launch script
+# (e.g. main.py) again: its top level must be under if __name__ == "__main__".
+
+def split_conf(configuration, name):
+    # configurations of the parts, without the instrument keys of a rig
+    key = configuration.get("rig_split", "pixel_loop")
+    items = planner.loop_values(configuration)["pixel"] if key == "pixel_loop" else [[item] for item in configuration[key]]
+    confs = []
+    for j, part in enumerate(items):
+        conf = json.loads(json.dumps(configuration))
+        del conf["rigs"]
+        if key == "pixel_loop":
+            conf["pixel_loop"]["loop"] = part
+        else:
+            conf[key] = part
+        conf["output_folder"] = "{}/part{}".format(name, j)
+        confs.append(conf)
+    return confs
+
+def rig_process(k, rig, parts, stop_event, messages):
+    def send(kind):
+        return lambda *args: messages.put((k, kind, args))
+    while not stop_event.is_set():
+        part = parts.get()
+        if part is None or stop_event.is_set():
+            break
+        j, conf = part
+        messages.put((k, "start", (j,)))
+        result = []
+        try:
+            folder = "./output/{}".format(conf["output_folder"])
+            if Path(folder, "conf.json").exists():
+                # started by a rig that failed, continue from its checkpoint
+                conf = dict(((key, rig[key]) for key in Run.Run.resume_keys if key in rig), resume_folder=folder)
+            else:
+                conf = dict(conf, rig=k, **rig)
+            run = Run.Run(send_stop_run=lambda *args: result.append(args), send_progress=send("progress"))
+            run.start_run(conf)
+            while run.is_alive():
+                if stop_event.wait(0.5):
+                    run.stop_run()
+                    run.join()
+        except Exception as e:
+            print(traceback.format_exc())
+            result.append((False, "Rig exception {}: {}".format(type(e).__name__, e)))
+        failed = [args[1] for args in result if len(args) > 0 and args[0] is False]
+        if failed or not result:
+            messages.put((k, "failed", (j, failed[-1] if failed else "Run ended without a result")))
+            break
+        messages.put((k, "done", (j,)))
+    messages.put((k, "exit", ()))
+
+class MultiRun(T.Thread):
+    def __init__(self, send_stop_run = lambda *args:None):
+        super(MultiRun, self).__init__(daemon=True)
+        self.send_stop_run = send_stop_run
+        self.ctx = mp.get_context("spawn")
+        self.stop_event = self.ctx.Event()
+        self.messages = self.ctx.Queue()
+
+    def start_run(self, configuration):
+        self.conf = configuration
+        self.stop_event.clear()
+        name = configuration['output_folder'].format(timestamp=datetime.now().strftime("%m_%d_%Y-%H_%M_%S"))
+        self.outputfolder = "./output/{}".format(name)
+        Path(self.outputfolder).mkdir(parents=True, exist_ok=True)
+        with open("{}/conf.json".format(self.outputfolder), "w") as write_file:
+            json.dump(configuration, write_file, indent=4)
+        self.confs = split_conf(configuration, name)
+        if any(len(configuration[key]) == 0 for key in ["smu_periods_arr", "Vf_prof_arr", "Duty_cycles"]):
+            self.confs = []
+        self.parts = [{"status": "pending", "rig": None, "step": 0, "steps": None} for _ in self.confs]
+        self.status = [{"status": "pending", "part": None, "parts_done": 0, "message": ""} for _ in configuration["rigs"]]
+        self.start()
+
+    def stop_run(self):
+        self.stop_event.set()
+
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def save_progress(self):
+        steps = [p["steps"] for p in self.parts if p["steps"] is not None]
+        progress = {
+            "step": sum(p["step"] for p in self.parts),
+            "steps": sum(steps) if len(steps) == len(self.parts) else None,
+            "parts_done": sum(p["status"] == "done" for p in self.parts),
+            "parts": self.parts,
+            "rigs": self.status,
+        }
+        with open("{}/progress.json".format(self.outputfolder), "w") as write_file:
+            json.dump(progress, write_file, indent=4)
+
+    def run(self):
+        queue_parts = self.ctx.Queue()
+        for j, conf in enumerate(self.confs):
+            queue_parts.put((j, conf))
+        processes = {}
+        if self.confs:
+            for k, rig in enumerate(self.conf["rigs"]):
+                p = self.ctx.Process(target=rig_process, args=(k, rig, queue_parts, self.stop_event, self.messages), daemon=True)
+                p.start()
+                processes[k] = p
+                self.status[k]["status"] = "running"
+        self.save_progress()
+
+        def requeue(k, message):
+            j = self.status[k]["part"]
+            self.status[k].update(status="failed", part=None, message=message)
+            if j is not None and not self.stopped():
+                print("Rig {} failed, part {} goes back to the queue".format(k, j))
+                self.parts[j]["status"] = "pending"
+                queue_parts.put((j, self.confs[j]))
+
+        running = set(processes)
+        finishing = False
+        while running:
+            if not finishing and (self.stopped() or all(p["status"] == "done" for p in self.parts)):
+                # rigs waiting for a part end on None
+                finishing = True
+                for _ in running:
+                    queue_parts.put(None)
+            try:
+                k, kind, args = self.messages.get(timeout=1)
+            except queue.Empty:
+                for k in list(running):
+                    if not processes[k].is_alive():
+                        # died without an exit message
+                        running.discard(k)
+                        requeue(k, "Rig process exited with code {}".format(processes[k].exitcode))
+                        self.save_progress()
+                continue
+            if kind == "start":
+                j = args[0]
+                self.status[k]["part"] = j
+                self.parts[j].update(status="running", rig=k)
+            elif kind == "progress":
+                j = self.status[k]["part"]
+                self.parts[j].update(step=args[0]["step"], steps=args[0]["steps"])
+                print("Rig {}: part {}, step {} of {}".format(k, j, args[0]["step"], args[0]["steps"]))
+            elif kind == "done":
+                j = args[0]
+                self.parts[j]["status"] = "stopped" if self.stopped() else "done"
+                self.status[k]["part"] = None
+                self.status[k]["parts_done"] += self.parts[j]["status"] == "done"
+            elif kind == "failed":
+                requeue(k, args[1])
+            elif kind == "exit":
+                running.discard(k)
+                processes[k].join()
+                if self.status[k]["status"] == "running":
+                    self.status[k]["status"] = "stopped" if self.stopped() else "done"
+            self.save_progress()
+        queue_parts.cancel_join_thread()
+
+        failed = ["rig{}: {}".format(k, s["message"]) for k, s in enumerate(self.status) if s["status"] == "failed"]
+        left = [j for j, p in enumerate(self.parts) if p["status"] != "done"]
+        if left and not self.stopped():
+            failed.append("parts not measured: {}".format(", ".join("part{}".format(j) for j in left)))
+        if failed:
+            self.send_stop_run(False, "; ".join(failed))
+        else:
+            self.send_stop_run()
+        print("All rigs finished")
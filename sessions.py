@@ -0,0 +1,81 @@
+import atexit
+import traceback
+import threading as T
+import importlib.util
+
+# Driver modules and open instruments kept for the lifetime of the process, so
+# runs started one after another (main.start_run) skip imports and reconnects.
+# An instrument is pooled if its class has:
+#   check()         - True if the connection still answers
+#   park()          - safe state between runs (outputs off), the connection stays open
+#   resume(*args)   - make it ready for the next run, e.g. with its custom parameters
+# Instruments without them are disconnected at the end of every run, as before,
+# and so is every instrument of a failed run.
+# Idle instruments are kept per (kind, port), at most one per port, and
+# disconnected on exit or when the port is asked for with another driver.
+
+modules = {}
+idle = {}
+lock = T.Lock()
+
+def load_driver(folder, name):
+    with lock:
+        if (folder, name) not in modules:
+            spec = importlib.util.spec_from_file_location(name, "{}/{}.py".format(folder, name))
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            modules[(folder, name)] = mod
+        return modules[(folder, name)]
+
+def poolable(inst):
+    return all(hasattr(inst, name) for name in ("check", "park", "resume"))
+
+def discard(inst):
+    try:
+        inst.disconnect()
+    except Exception:
+        print(traceback.format_exc())
+
+def acquire(kind, driver, port, open_new, *args):
+    # an idle instrument that still answers, or a new one from open_new()
+    with lock:
+        held, inst = idle.pop((kind, port), (None, None))
+    if inst is not None and held != driver:
+        discard(inst)
+        inst = None
+    if inst is not None:
+        try:
+            if inst.check():
+                inst.resume(*args)
+                print("{} reused: {}".format(kind, port))
+                return inst
+            print("{} not answering, reconnecting: {}".format(kind, port))
+        except Exception:
+            print(traceback.format_exc())
+        discard(inst)
+    return open_new()
+
+def release(kind, driver, port, inst):
+    if not poolable(inst):
+        inst.disconnect()
+        return
+    try:
+        inst.park()
+    except Exception:
+        print(traceback.format_exc())
+        discard(inst)
+        return
+    with lock:
+        _, previous = idle.pop((kind, port), (None, None))
+        idle[(kind, port)] = (driver, inst)
+    if previous is not None:
+        discard(previous)
+
+def close_all():
+    with lock:
+        instruments = list(idle.values())
+        idle.clear()
+    for _, inst in instruments:
+        discard(inst)
+
+atexit.register(close_all)
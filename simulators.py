@@ -0,0 +1,379 @@
+import re
+import time
+import importlib.util
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+
+# Local stand-ins for the instruments, used by the sim_* drivers and by COMM
+# when comm_port starts with "sim". Link behaviour is set through the port
+# string, e.g. "sim?latency=0.002&bandwidth=1e6&error_rate=0.001&time_scale=0":
+#   latency    - seconds added to every transaction
+#   bandwidth  - bytes/s for the payload of every transaction
+#   error_rate - probability that a transaction fails (instrument error, lost reply)
+#   time_scale - fraction of the simulated measurement time that is really waited
+
+def port_options(port, defaults):
+    options = dict(defaults)
+    for k, v in parse_qsl(urlsplit(port).query):
+        options[k] = float(v)
+    return options
+
+def load_driver(folder, name):
+    spec = importlib.util.spec_from_file_location(name, "{}/{}.py".format(folder, name))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+class SimLink:
+    defaults = {"latency": 0.001, "bandwidth": 1e6, "error_rate": 0.0, "time_scale": 0.0}
+
+    def __init__(self, port) -> None:
+        self.options = port_options(port, self.defaults)
+        self.latency = self.options["latency"]
+        self.bandwidth = self.options["bandwidth"]
+        self.error_rate = self.options["error_rate"]
+        self.time_scale = self.options["time_scale"]
+        self.rng = np.random.default_rng(int(self.options.get("seed", 0)))
+
+    def transfer(self, nbytes):
+        delay = self.latency + nbytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def wait(self, seconds):
+        if seconds * self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def failed(self):
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+class SimVisa(SimLink):
+    # message based VISA resource: write()/read()/query() with a response queue
+    def __init__(self, port) -> None:
+        super().__init__(port)
+        self.timeout = 2000
+        self.read_termination = None   # pyvisa default, reads go to the end of the message
+        self.responses = []
+        self.buffer = b""              # unread rest of the message being read
+        self.errors = []
+        self.state = {}
+
+    def header(self, cmd):
+        # "SOURCE2:VOLT:TRIG 0.5" -> ("SOUR:VOLT:TRIG", [2], "0.5"); "INIT (@1,2)" -> ("INIT", [1, 2], "(@1,2)")
+        parts = cmd.strip().split(None, 1)
+        arg = parts[1].strip() if len(parts) > 1 else ""
+        suffix = re.search(r"[A-Z](\d+)", parts[0].upper())
+        chlist = re.search(r"\(@([\d,]+)\)", arg)
+        if chlist:
+            channels = [int(ch) for ch in chlist.group(1).split(",")]
+        else:
+            channels = [int(suffix.group(1)) if suffix else 1]
+        head = re.sub(r"([A-Z])\d+", r"\1", parts[0].lstrip(":").upper())
+        head = head.replace("SOURCE", "SOUR")
+        return head, channels, arg
+
+    def write(self, cmd):
+        self.transfer(len(cmd) + 1)
+        if cmd.strip() == "":
+            return
+        if self.failed():
+            self.errors.append('-113,"Undefined header (simulated)"')
+            return
+        # compound message "A:B?;C?;:D?": C is relative to A:, D starts from the root.
+        # The replies of all queries come back as one message joined by ';'.
+        pending = len(self.responses)
+        path = ""
+        for part in cmd.split(";"):
+            part = part.strip()
+            if part.startswith(":") or part.startswith("*"):
+                part = part.lstrip(":")
+            elif path:
+                part = path + part
+            if ":" in part.split(None, 1)[0]:
+                path = part.split(None, 1)[0].rsplit(":", 1)[0] + ":"
+            self.execute(part)
+        if len(self.responses) > pending + 1:
+            replies = self.responses[pending:]
+            del self.responses[pending:]
+            self.responses.append(b";".join(r if isinstance(r, bytes) else r.encode() for r in replies))
+
+    def execute(self, cmd):
+        head, channels, arg = self.header(cmd)
+        if head in ("SYST:ERR:COUN?",):
+            self.responses.append("+{}".format(len(self.errors)))
+        elif head == "SYST:ERR?":
+            self.responses.append(self.errors.pop(0) if self.errors else '+0,"No error"')
+        elif head == "*IDN?":
+            self.responses.append(self.idn)
+        elif head == "*OPC?":
+            self.responses.append("1")
+        else:
+            self.command(head, channels, arg)
+
+    def command(self, head, channels, arg):
+        if not head.endswith("?"):
+            for ch in channels:
+                self.state[(ch, head)] = arg
+
+    def message(self):
+        if not self.buffer:
+            if not self.responses:
+                raise TimeoutError("VISA timeout (simulated): nothing to read")
+            resp = self.responses.pop(0)
+            resp = resp if isinstance(resp, bytes) else resp.encode()
+            self.buffer = resp if resp.endswith(b"\n") else resp + b"\n"
+        return self.buffer
+
+    def read_raw(self):
+        # like VISA with the termination character enabled: up to the first
+        # read_termination byte, even inside a binary block
+        message = self.message()
+        end = len(message)
+        if self.read_termination:
+            end = message.find(self.read_termination.encode()) + 1 or end
+        resp, self.buffer = message[:end], message[end:]
+        self.transfer(len(resp))
+        return resp
+
+    def read(self):
+        return self.read_raw().decode().rstrip("\r\n")
+
+    def read_bytes(self, count):
+        message = self.message()
+        if len(message) < count:
+            raise TimeoutError("VISA timeout (simulated): {} of {} bytes".format(len(message), count))
+        resp, self.buffer = message[:count], message[count:]
+        self.transfer(len(resp))
+        return resp
+
+    def query(self, cmd):
+        self.write(cmd)
+        return self.read()
+
+    def read_stb(self):
+        self.transfer(1)
+        return 0x04 if self.errors else 0
+
+    def close(self):
+        pass
+
+    def number(self, head, default, ch=1):
+        try:
+            return float(self.state.get((ch, head), default))
+        except ValueError:
+            return float(default)
+
+class SimB29xx(SimVisa):
+    # B2900 series SMU: pulsed READ/FETC:ARR? blocks (VOLT,CURR,TIME as big-endian
+    # REAL,64) and :MEAS? for the DC driver. The device is an ohmic load whose
+    # conductance drifts down under stress.
+    idn = "Keysight Technologies,B2902A,SIM0001,0.0 (simulated)"
+    conductance = 1e-3
+    drift = 0.1
+    tau = 60.0
+    noise = 1e-6
+
+    def __init__(self, port) -> None:
+        super().__init__(port)
+        self.clock = 0.0
+        self.stress = {}
+        self.blocks = {}
+
+    def current(self, v, t, ch):
+        g = self.conductance * (1 - self.drift * (1 - np.exp(-t / self.tau)))
+        i = g * v + self.rng.normal(0, self.noise, np.shape(v))
+        comp = abs(self.number("SENS:CURR:PROT", 0.01, ch))
+        return np.clip(i, -comp, comp)
+
+    def command(self, head, channels, arg):
+        if head in ("READ:ARR?", "FETC:ARR?"):
+            ch = channels[0]
+            if head == "READ:ARR?" or ch not in self.blocks:
+                self.measure(channels)
+            self.responses.append(self.blocks.pop(ch))
+        elif head == "INIT":
+            self.measure(channels)
+        elif head == "ABOR":
+            self.blocks = {}
+        elif head == "SYST:TIME:TIM:COUN:RES":
+            self.clock = 0.0
+        elif head == "MEAS?":
+            ch = channels[0]
+            v = self.number("SOUR:VOLT", 0, ch)
+            self.stress[ch] = self.stress.get(ch, 0.0) + 0.1
+            self.responses.append("{:e},{:e}".format(v, float(self.current(v, self.stress[ch], ch))))
+        else:
+            super().command(head, channels, arg)
+
+    def measure(self, channels):
+        # all listed channels run in parallel; the clock advances by the longest one.
+        # With SYST:TIME:TIM:COUN:RES:AUTO ON the timer restarts with every INIT/READ.
+        if self.state.get((1, "SYST:TIME:TIM:COUN:RES:AUTO"), "OFF").upper() in ("ON", "1"):
+            self.clock = 0.0
+        longest = 0.0
+        for ch in channels:
+            n = int(self.number("ARM:ALL:COUN", 1, ch)) * int(self.number("TRIG:ALL:COUN", 1, ch))
+            step = self.number("SOUR:PULS:WIDT", 0, ch) + self.number("SOUR:PULS:DEL", 0, ch)
+            duration = n * step
+            longest = max(longest, duration)
+            t = self.clock + step * np.arange(1, n + 1)
+            v = np.full(n, self.number("SOUR:VOLT:TRIG", 0, ch))
+            stress = self.stress.get(ch, 0.0)
+            block = np.empty((n, 3), dtype=">f8")
+            block[:,0] = v + self.rng.normal(0, 1e-4, n)
+            block[:,1] = self.current(v, stress + t - self.clock, ch)
+            block[:,2] = t
+            self.stress[ch] = stress + duration
+            payload = block.tobytes()
+            length = str(len(payload)).encode()
+            self.blocks[ch] = b"#" + str(len(length)).encode() + length + payload + b"\n"
+        self.wait(longest)
+        self.clock += longest
+
+class SimScope(SimVisa):
+    # Tektronix style scope used by PCB_board: WFMPRE scaling and 8 bit CURVE? records,
+    # FastFrame (HOR:FAST:STATE/COUN) returns all frames in one CURVE? block.
+    # The trigger channel is a noisy square wave with a finite rise time, the data
+    # channel follows it with a delay.
+    idn = "TEKTRONIX,TDS2024C,SIM0001,0.0 (simulated)"
+    record_length = 2500
+    period = 250
+
+    def __init__(self, port) -> None:
+        super().__init__(port)
+        self.state[(1, "DATA:SOUR")] = "CH1"   # header() shortens SOURCE
+        self.state[(1, "WFMPRE:YMULT")] = "0.4"
+        self.state[(1, "WFMPRE:YZERO")] = "0"
+        self.state[(1, "WFMPRE:YOFF")] = "128"
+        self.state[(1, "WFMPRE:XINCR")] = "1e-6"
+
+    def command(self, head, channels, arg):
+        if head.startswith("WFMPRE:") and head.endswith("?"):
+            self.responses.append(self.state.get((1, head[:-1]), "0"))
+        elif head == "CURVE?":
+            frames = int(self.number("HOR:FAST:COUN", 1)) if self.state.get((1, "HOR:FAST:STATE"), "OFF").upper() in ("ON", "1") else 1
+            payload = np.concatenate([self.curve(self.state[(1, "DATA:SOUR")]) for _ in range(frames)]).tobytes()
+            length = str(len(payload)).encode()
+            self.responses.append(b"#" + str(len(length)).encode() + length + payload + b"\n")
+        else:
+            super().command(head, channels, arg)
+
+    def curve(self, source):
+        self.wait(self.record_length * 1e-6)
+        k = np.arange(self.record_length)
+        square = (k % self.period) < self.period // 2
+        if source.upper().endswith("1"):
+            ramp = np.clip((k % self.period) / 10, 0, 1) * square
+            wave = 56 + 144 * ramp + self.rng.normal(0, 3, k.shape)
+        else:
+            wave = 128 + 60 * np.roll(square, self.period // 10) + self.rng.normal(0, 2, k.shape)
+        return np.clip(wave, 0, 255).astype(np.uint8)
+
+    def query_binary_values(self, cmd, datatype='B', is_big_endian=False, container=list):
+        self.write(cmd)
+        raw = self.read_raw()
+        n = int(raw[1:2])
+        data = np.frombuffer(raw, dtype=np.uint8, count=int(raw[2:2+n]), offset=2+n)
+        return data if container is np.ndarray else container(data)
+
+class SimDps5005(SimLink):
+    # minimalmodbus.Instrument with the DPS5005 register map. The set voltage is
+    # only accepted up to voltage_in / 1.1, like on the real unit.
+    defaults = {"latency": 0.004, "bandwidth": 960.0, "error_rate": 0.0, "time_scale": 0.0}
+
+    class Serial:
+        baudrate = 9600
+        bytesize = 8
+        timeout = 0.5
+        def close(self):
+            pass
+
+    def __init__(self, port) -> None:
+        super().__init__(port)
+        self.serial = SimDps5005.Serial()
+        self.registers = [0] * 0x60
+        self.registers[0x05] = 2400     # voltage_in, 24.00 V
+        self.registers[0x0B] = 5005     # model
+        self.registers[0x0C] = 16       # version
+
+    def transaction(self, request, response):
+        self.transfer(request + response)
+        if self.failed():
+            raise IOError("No communication with the instrument (simulated)")
+
+    def update(self):
+        on = self.registers[0x09]
+        self.registers[0x02] = self.registers[0x00] if on else 0
+        self.registers[0x03] = self.registers[0x01] if on else 0
+        self.registers[0x04] = self.registers[0x02] * self.registers[0x03] // 1000
+
+    def store(self, reg_addr, raw):
+        if reg_addr == 0x00 and raw * 1.1 > self.registers[0x05]:
+            return
+        if reg_addr in (0x02, 0x03, 0x04, 0x05, 0x07, 0x08, 0x0B, 0x0C):
+            return
+        self.registers[reg_addr] = raw
+        self.update()
+
+    def read_register(self, reg_addr, decimal_places=0):
+        self.transaction(8, 7)
+        return self.registers[reg_addr] / float(10 ** decimal_places)
+
+    def read_registers(self, reg_addr, size_of_block):
+        self.transaction(8, 5 + 2 * size_of_block)
+        return list(self.registers[reg_addr:reg_addr + size_of_block])
+
+    def write_register(self, reg_addr, value, decimal_places=0):
+        self.transaction(8, 8)
+        self.store(reg_addr, int(round(value * 10 ** decimal_places)))
+
+    def write_registers(self, reg_addr, values):
+        self.transaction(9 + 2 * len(values), 8)
+        for k, raw in enumerate(values):
+            self.store(reg_addr + k, int(raw))
+
+class SimArduino(SimLink):
+    # serial.Serial running the COMM relay firmware: "Ready!" on connect, then one
+    # "1" line per pin string or "setdelay N" command, after the relay delay.
+    # A failed transaction loses the reply.
+    defaults = {"latency": 0.0005, "bandwidth": 11520.0, "error_rate": 0.0, "time_scale": 1.0}
+
+    def __init__(self, port, baudrate=115200, timeout=10) -> None:
+        super().__init__(port)
+        self.timeout = timeout
+        self.is_open = True
+        self.busy_until = 0.0
+        self.relay_delay = 0.0
+        self.lines = [(time.time() + self.latency, b"Ready!\r\n")]
+
+    @property
+    def in_waiting(self):
+        now = time.time()
+        return sum(len(line) for ready, line in self.lines if ready <= now)
+
+    def write(self, data):
+        cmd = data.decode().strip()
+        self.transfer(len(data))
+        delay = 3 / self.bandwidth
+        if cmd.startswith("setdelay"):
+            self.relay_delay = float(cmd.split()[1]) / 1000
+        else:
+            delay += self.relay_delay * self.time_scale
+        # the board works through the commands one after another
+        ready = max(time.time(), self.busy_until) + delay
+        self.busy_until = ready
+        if not self.failed():
+            self.lines.append((ready, b"1\r\n"))
+        return len(data)
+
+    def readline(self):
+        if not self.lines:
+            time.sleep(self.timeout)
+            return b""
+        ready, line = self.lines.pop(0)
+        if ready > time.time():
+            time.sleep(ready - time.time())
+        return line
+
+    def close(self):
+        self.is_open = False
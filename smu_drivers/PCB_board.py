@@ -1,7 +1,18 @@
 
+import time
 import pyvisa
 import numpy as np
 
+def parse_block(raw):
+    # "<preamble fields>;#<n><length><payload>\n" -> (fields, payload offset, payload length)
+    start = raw.find(b"#")
+    if start < 0:
+        raise Exception("Invalid CURVE? response")
+    fields = raw[:start].decode().strip().rstrip(";").split(";") if start > 0 else []
+    n = int(raw[start+1:start+2])
+    offset = start + 2 + n
+    return fields, offset, int(raw[start+2:offset])
+
 class SMU:
     parameters = {
         "threshold": {
@@ -15,52 +26,267 @@ class SMU:
         },
         "data_ch": {
             'type': "text"
+        },
+        "pipelined": {
+            'type': "text"
+        },
+        "mode": {
+            'type': "text"
+        },
+        "frames": {
+            'type': "text"
+        },
+        "hysteresis": {
+            'type': "text"
+        },
+        "window": {
+            'type': "text"
         }
     }
 
+    # The preamble is read in the same transfer as the curve, so one round trip per
+    # channel; scaling coefficients and decode buffers are only rebuilt when the
+    # preamble or the record length changes.
+    preamble_query = "WFMPRE:YMULT?;YZERO?;YOFF?;XINCR?"
+    pipelined = "0"
+
+    # mode "edge": measureVI returns the mean signal after the rising edges of one
+    # record and 0 as the current (DC loop of Run).
+    # mode "segmented": <frames> triggered records come in one FastFrame transfer and
+    # measureVI returns one row per rising edge, V = signal averaged over <window>
+    # samples from edge + shift, I = 0, T = edge time (pulse loop of Run, like the
+    # B29xx blocks). Edges are found with <hysteresis> volts around the threshold.
+    # T runs on the records laid end to end after the last configure(); the
+    # statistics of every record (from its start time on T) are handed to Run
+    # once per transfer by pop_records() and end up in the summary files.
+    modes = ["edge", "segmented"]
+    mode = "edge"
+    frames = 1
+    hysteresis = 0
+    window = 1
+    record_dtype = np.dtype([("time", "f8"), ("edges", "i8"), ("mean", "f8"), ("std", "f8"), ("min", "f8"), ("max", "f8")])
+
     def __init__(self, port, custom_parameters={}) -> None:
         for k,v in custom_parameters.items():
             setattr(self, k, v['value'])
         self.trig_ch = (self.trig_ch)
         self.data_ch = (self.data_ch)
-        self.shift = int(self.shift)
-        self.threshold = float(self.threshold)
+        self.parse_parameters()
         print("Custom pars: {}".format(custom_parameters))
-        
-        self.rm = pyvisa.ResourceManager() 
-        self.port = self.rm.open_resource(port)
+
+        self.port = self.open_resource(port)
         self.port.write('*IDN?')
         resp = self.port.read().strip()
         assert resp != "", "Invalid SMU responce"
         print("SMU connected: ", resp)
+        self.port.write('HEADER OFF')
         self.port.write('DATA:WIDTH 1')
-        self.port.write('DATA:ENC RPB') 
+        self.port.write('DATA:ENC RPB')
+        self.invalidate_config()
+        self.armed = False
+        self.fast_frames = None
+        self.records = 0
+        self.edges = 0
+        self.transfers = 0
+        self.decode_time = 0.0
+        self.record_stats = None
+        self.record_time = 0.0
+        self.setup_acquisition()
         print("SMU ready")
 
+    def parse_parameters(self):
+        self.shift = int(self.shift)
+        self.threshold = float(self.threshold)
+        self.pipelined = str(self.pipelined) in ("1", "true", "True", "ON")
+        assert self.mode in SMU.modes, "mode must be one of {}".format(SMU.modes)
+        self.frames = int(self.frames)
+        self.hysteresis = float(self.hysteresis)
+        self.window = int(self.window)
+
+    def setup_acquisition(self):
+        # pipelined: single sequence, every acquisition is armed by the driver
+        self.port.write('ACQ:STOPA SEQ' if self.pipelined else 'ACQ:STOPA RUNST')
+        frames = self.frames if self.mode == "segmented" else None
+        if frames != self.fast_frames:
+            if frames is None:
+                self.port.write('HOR:FAST:STATE OFF')
+            else:
+                self.port.write('HOR:FAST:COUN {}'.format(frames))
+                self.port.write('HOR:FAST:STATE ON')
+                self.port.write('DATA:FRAMESTART 1')
+                self.port.write('DATA:FRAMESTOP {}'.format(frames))
+            self.fast_frames = frames
+            self.armed = False
+
+    def configure(self, custom_parameters={}, reset_time=True):
+        # Run's pulse loop passes the B29xx pulse parameters too; only ours are used
+        for k,v in custom_parameters.items():
+            if k in SMU.parameters:
+                setattr(self, k, v['value'])
+        self.parse_parameters()
+        self.setup_acquisition()
+        if reset_time:
+            self.record_time = 0.0
+
+    def open_resource(self, port):
+        self.rm = pyvisa.ResourceManager()
+        return self.rm.open_resource(port)
+
+    # session pool, see sessions.py
+    def check(self):
+        return self.port.query('*IDN?').strip() != ""
+
+    def park(self):
+        self.free_run()
+        print("SMU parked")
+
+    def resume(self, custom_parameters={}):
+        for k,v in custom_parameters.items():
+            setattr(self, k, v['value'])
+        self.parse_parameters()
+        self.invalidate_config()
+        self.records = 0
+        self.edges = 0
+        self.transfers = 0
+        self.decode_time = 0.0
+        self.record_time = 0.0
+        self.setup_acquisition()
+
+    def invalidate_config(self):
+        # channel -> preamble fields, record length, scale, offset, xincr and decode buffer
+        self.scaling = {}
+
     def applyV(self, v):
         pass
-        
+
+    def arm(self):
+        self.port.write('ACQ:STATE RUN')
+        self.armed = True
+
+    def fetch(self, channel):
+        # raw response of one channel: preamble and curve in one transfer
+        self.transfers += 1
+        self.port.write("DATA:SOURCE CH{};:{};:CURVE?".format(channel, self.preamble_query))
+        return self.port.read_raw()
+
+    def decode(self, channel, raw):
+        fields, offset, length = parse_block(raw)
+        cached = self.scaling.get(channel)
+        if cached is None or cached["fields"] != fields or cached["length"] != length:
+            ymult, yzero, yoff, xincr = [float(x) for x in fields]
+            # Volts = ((ADC - yoff) * ymult + yzero) / 10, Yuliia's advice
+            cached = {"fields": fields, "length": length, "scale": ymult / 10, "offset": (yzero - yoff * ymult) / 10, "xincr": xincr, "volts": np.empty(length)}
+            self.scaling[channel] = cached
+        volts = cached["volts"]
+        np.multiply(np.frombuffer(raw, dtype=np.uint8, count=length, offset=offset), cached["scale"], out=volts)
+        volts += cached["offset"]
+        return volts
+
+    def rising_edges(self, trig_data):
+        # (record, sample) of every rising edge. With hysteresis the trigger has to
+        # drop below threshold - h/2 before a crossing of threshold + h/2 counts.
+        if self.hysteresis <= 0:
+            return np.nonzero(np.diff(np.sign(trig_data - self.threshold), axis=1) > 0)
+        high = trig_data > self.threshold + self.hysteresis / 2
+        low = trig_data < self.threshold - self.hysteresis / 2
+        # last level outside the band, carried forward through the band
+        known = np.where(high | low, np.arange(trig_data.shape[1]), 0)
+        np.maximum.accumulate(known, axis=1, out=known)
+        level = np.take_along_axis(high, known, axis=1)
+        was_low = np.take_along_axis(low, known, axis=1)
+        records, samples = np.nonzero(level[:,1:] & was_low[:,:-1])
+        return records, samples
+
+    def edge_values(self, trig_data, sig_data):
+        # mean of <window> signal samples from every rising edge + shift, in one pass
+        records, samples = self.rising_edges(trig_data)
+        start = samples + self.shift
+        valid = (start >= 0) & (start + self.window <= sig_data.shape[1])
+        records, samples, start = records[valid], samples[valid], start[valid]
+        if self.window == 1:
+            values = sig_data[records, start]
+        else:
+            csum = np.zeros((sig_data.shape[0], sig_data.shape[1] + 1))
+            np.cumsum(sig_data, axis=1, out=csum[:,1:])
+            values = (csum[records, start + self.window] - csum[records, start]) / self.window
+        return records, samples, values
+
+    def per_record(self, n_records, records, values):
+        stats = np.zeros(n_records, dtype=SMU.record_dtype)
+        count = np.bincount(records, minlength=n_records)
+        total = np.bincount(records, values, minlength=n_records)
+        squares = np.bincount(records, values * values, minlength=n_records)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean"] = total / count
+            stats["std"] = np.sqrt(np.maximum(squares / count - stats["mean"] ** 2, 0))
+        stats["edges"] = count
+        stats["min"] = np.inf
+        stats["max"] = -np.inf
+        np.minimum.at(stats["min"], records, values)
+        np.maximum.at(stats["max"], records, values)
+        empty = count == 0
+        stats["min"][empty] = np.nan
+        stats["max"][empty] = np.nan
+        return stats
+
     def measureVI(self):
-        trig_data = self.acquire(self.trig_ch)
-        sig_data = self.acquire(self.data_ch)
-        threshold = self.threshold
-        rising_edge =  np.argwhere(np.diff(np.sign(trig_data - threshold)) > 0 ).flatten()
-        meas_data = sig_data[rising_edge + self.shift]
-        return np.mean(meas_data), 0
+        if self.pipelined:
+            if not self.armed:
+                self.arm()
+            self.port.query('*OPC?')   # the armed acquisition is complete
+            trig_raw = self.fetch(self.trig_ch)
+            sig_raw = self.fetch(self.data_ch)
+            self.arm()                 # the next acquisition runs while this one is decoded
+        else:
+            trig_raw = self.fetch(self.trig_ch)
+            sig_raw = self.fetch(self.data_ch)
+        start = time.perf_counter()
+        n_records = self.fast_frames or 1
+        trig_data = self.decode(self.trig_ch, trig_raw).reshape(n_records, -1)
+        sig_data = self.decode(self.data_ch, sig_raw).reshape(n_records, -1)
+        records, samples, values = self.edge_values(trig_data, sig_data)
+        self.records += n_records
+        self.edges += len(values)
+        if self.mode == "edge":
+            self.decode_time += time.perf_counter() - start
+            return np.mean(values), 0
+        xincr = self.scaling[self.trig_ch]["xincr"]
+        record_length = trig_data.shape[1]
+        self.record_stats = self.per_record(n_records, records, values)
+        self.record_stats["time"] = self.record_time + np.arange(n_records) * record_length * xincr
+        block = np.zeros((len(values), 3))
+        block[:,0] = values
+        block[:,2] = self.record_time + (records * record_length + samples + 1) * xincr
+        self.record_time += n_records * record_length * xincr
+        self.decode_time += time.perf_counter() - start
+        return block
+
+    def pop_records(self):
+        # statistics of the records of the last transfer, None if already taken
+        stats, self.record_stats = self.record_stats, None
+        return stats
+
+    def acquisition_stats(self):
+        return {"records": self.records, "edges": self.edges, "decode_time": self.decode_time}
+
+    def transactions(self):
+        return {"transfers": self.transfers}
+
+    def free_run(self):
+        # scope back to free running single records, as the operator expects it
+        if self.fast_frames is not None:
+            self.port.write('HOR:FAST:STATE OFF')
+            self.fast_frames = None
+        if self.pipelined:
+            self.port.write('ACQ:STOPA RUNST')
+            self.port.write('ACQ:STATE RUN')
+            self.armed = False
 
     def disconnect(self):
+        self.free_run()
         self.port.close()
         print("SMU disconnected")
 
     def acquire(self, channel):
-        try:
-            self.port.write("DATA:SOURCE CH" + str(channel))
-            ymult = float(self.port.query('WFMPRE:YMULT?'))
-            yzero = float(self.port.query('WFMPRE:YZERO?'))
-            yoff = float(self.port.query('WFMPRE:YOFF?'))        
-            ADC_wave = np.array(self.port.query_binary_values('CURVE?', datatype='B'))
-            Volts = (ADC_wave - yoff) * ymult  + yzero
-            Volts /= 10 # Yuliia's advice 
-            return Volts
-        except IndexError:
-            return 0
\ No newline at end of file
+        # one decoded waveform of a channel, in volts; the buffer is reused by the next call
+        return self.decode(channel, self.fetch(channel))
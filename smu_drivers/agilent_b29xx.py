@@ -267,8 +267,7 @@ class SMU(Device):
             setattr(self, k, v['value'])
         self.channel = int(self.channel)
         print("Custom pars: ch {}, npls {}".format(self.channel, self.nplc))
-        self.rm = pyvisa.ResourceManager() 
-        self.port = self.rm.open_resource(port)
+        self.port = self.open_resource(port)
         self.port.write('*IDN?')
         resp = self.port.read().strip()
         assert resp != "", "Invalid SMU responce"
@@ -278,6 +277,27 @@ class SMU(Device):
         self.poweron()
         print("SMU ready")
 
+    def open_resource(self, port):
+        self.rm = pyvisa.ResourceManager() 
+        return self.rm.open_resource(port)
+
+    # session pool, see sessions.py
+    def check(self):
+        return self.port.query('*IDN?').strip() != ""
+
+    def park(self):
+        self.poweroff()
+        self.deinitialize()
+        print("SMU parked")
+
+    def resume(self, custom_parameters={}):
+        for k,v in custom_parameters.items():
+            setattr(self, k, v['value'])
+        self.channel = int(self.channel)
+        self.initialize()
+        self.configure()
+        self.poweron()
+
     def applyV(self, v):
         self.value = v
         self.apply()
@@ -1,6 +1,12 @@
 import pyvisa
+import time
+import traceback
 import numpy as np
-import numpy as np
+from contextlib import contextmanager
+
+# READ:ARR? returns VOLT,CURR,TIME triplets as big-endian REAL,64 (FORM:BORD NORM)
+sens_dtype = np.dtype(">f8")
+sens_record = np.dtype([("volt", ">f8"), ("curr", ">f8"), ("time", ">f8")])
 
 class SMU:
 
@@ -116,10 +122,35 @@ SYST:TIME:TIM:COUN:RES:AUTO ON
         },
         "channel": {
             'type': "text"
+        },
+        "errorpolicy": {
+            'type': "text"
+        },
+        "acqmode": {
+            'type': "text"
         }
     }
 
-    def checkerror(self, suppress_exception = False):
+    # How a block is acquired:
+    #   read  - READ:ARR? arms, waits and transfers in one blocking query
+    #   fetch - the next block is armed with INIT right after the previous one is
+    #           fetched (FETC:ARR?), so it is already running while Run handles the data.
+    #           The B29xx clears the result buffer on INIT, so the transfer itself
+    #           cannot overlap with the next block.
+    acq_modes = ["read", "fetch"]
+    acqmode = "read"
+
+    # When SYST:ERR:COUN? is asked:
+    #   command - after every command and query
+    #   batch   - once at the end of a batch (configure, one measured block), per command outside batches
+    #   block   - once per measured block, covering everything sent since the previous check
+    #   status  - serial poll after every command, error queue is read only if the EAV bit is set
+    error_policies = ["command", "batch", "block", "status"]
+    errorpolicy = "command"
+    stb_error_bit = 0x04
+
+    def checkerror(self, suppress_exception = False, context = None):
+        self.counts["errcheck"] += 1
         err = self.inst.query('SYST:ERR:COUN?')
         if (err != '+0'):
             numbers = int(err[1:])
@@ -128,52 +159,171 @@ SYST:TIME:TIM:COUN:RES:AUTO ON
                 print("Error ", err_n, ":")
                 print(self.inst.query("SYST:ERR?"))
             if not suppress_exception:
+                if context:
+                    raise Exception("SMU Exception in {}".format(context))
                 raise Exception("SMU Exception")
             else:
                 print("SMU errors were suppressed")
 
+    def aftercmd(self, cmd):
+        if self.errorpolicy == "command" or (self.errorpolicy == "batch" and self.batch_name is None):
+            self.checkerror(context=cmd)
+        elif self.errorpolicy == "status":
+            self.counts["stb"] += 1
+            if self.inst.read_stb() & SMU.stb_error_bit:
+                self.checkerror(context=cmd)
+        else:
+            name = self.batch_name if self.batch_name is not None else cmd
+            if name not in self.pending_checks:
+                self.pending_checks.append(name)
+
+    def flusherrors(self):
+        # one error check for everything deferred since the last one
+        if self.pending_checks:
+            context, self.pending_checks = ", ".join(self.pending_checks), []
+            self.checkerror(context=context)
+
+    @contextmanager
+    def batch(self, name):
+        if self.batch_name is not None:
+            yield
+            return
+        self.batch_name = name
+        try:
+            yield
+        except Exception:
+            # the deferred checks belong to the failed batch, report them now so the
+            # next flush does not blame its errors on other commands
+            if self.pending_checks:
+                context, self.pending_checks = ", ".join(self.pending_checks), []
+                try:
+                    self.checkerror(True, context)
+                except Exception:
+                    print(traceback.format_exc())
+            raise
+        finally:
+            self.batch_name = None
+        if self.errorpolicy == "batch":
+            self.flusherrors()
+
     def sendcmd(self, cmd):
+        self.counts["write"] += 1
         self.inst.write(cmd)
-        self.checkerror()
+        self.aftercmd(cmd)
         
     def querycmd(self, cmd):
+        self.counts["query"] += 1
         resp = self.inst.query(cmd)
-        self.checkerror()
+        self.aftercmd(cmd)
         return resp
 
-    def querybincmd(self, cmd):
-        resp = self.inst.query_binary_values(cmd, datatype='d', is_big_endian=True)
-        self.checkerror()
+    def readblock(self):
+        # Payload of an IEEE 488.2 definite length block, read by the length in its
+        # header. read_raw() would stop at the first 0x0A byte of the REAL,64 payload,
+        # as read_termination enables the termination character.
+        head = self.inst.read_bytes(2)
+        # the header arrives once the instrument has the data, the payload transfer follows
+        self.block_ready = time.perf_counter()
+        if head[:1] != b"#" or head[1:2] == b"0":
+            raise Exception("Invalid binary block header")
+        length = int(self.inst.read_bytes(int(head[1:2])))
+        payload = self.inst.read_bytes(length)
+        self.inst.read_bytes(1)   # message terminator
+        return payload
+
+    def querybincmd(self, cmd, dtype=sens_dtype):
+        self.counts["query"] += 1
+        self.inst.write(cmd)
+        payload = self.readblock()
+        start = time.perf_counter()
+        resp = np.frombuffer(payload, dtype=dtype, count=len(payload) // dtype.itemsize)
+        self.parse_time += time.perf_counter() - start
+        self.aftercmd(cmd)
         return resp
 
-    def getSensData(self):
-        res = self.querybincmd("READ:ARR? (@{ch})".format(ch=self.channel))
-        formatted_data = []
-        for i in range(0,len(res),3):
-            formatted_data.append([res[j] for j in range(i,i+3)])
-        return formatted_data
+    def transactions(self):
+        # bus transactions so far, by kind: write, query, errcheck (SYST:ERR:COUN?) and stb (serial poll)
+        return dict(self.counts, total=sum(self.counts.values()))
+
+    def getSensData(self, structured=False, fetch=False, channel=None):
+        # (N,3) view with VOLT,CURR,TIME columns, or a structured array with volt/curr/time fields
+        ch = self.channel if channel is None else channel
+        res = self.querybincmd("{}:ARR? (@{ch})".format("FETC" if fetch else "READ", ch=ch))
+        if structured:
+            return res.view(sens_record)
+        return res.reshape(-1, 3)
 
     def __init__(self, port, custom_parameters={}) -> None:
         print("SMU connecting: ", port)
-        for k,v in custom_parameters.items():
-            setattr(self, k, v['value'])
-        self.channel = int(self.channel)
-        print("Custom pars: ch {}, npls {}".format(self.channel, self.nplc))
+        self.set_parameters(custom_parameters)
+        # channels with a running INIT, None if nothing is armed
+        self.armed = None
+        self.batch_name = None
+        self.pending_checks = []
         
-        self.rm = pyvisa.ResourceManager() 
-        self.inst = self.rm.open_resource(port)
+        self.inst = self.open_resource(port)
         self.inst.read_termination = "\n"
         self.inst.write('*IDN?')
         resp = self.inst.read().strip()
         assert resp != "", "Invalid SMU responce"
         print("SMU connected: ", resp)
         self.checkerror(True)
+        # per channel: lines of start_measurement_cmd_set as last applied by configure()
+        self.applied_cmds = {}
+        self.timeouts = {}
+
+    def set_parameters(self, custom_parameters):
+        for k,v in custom_parameters.items():
+            setattr(self, k, v['value'])
+        self.channel = int(self.channel)
+        print("Custom pars: ch {}, npls {}".format(self.channel, self.nplc))
+        assert self.errorpolicy in SMU.error_policies, "Unknown errorpolicy {}".format(self.errorpolicy)
+        assert self.acqmode in SMU.acq_modes, "Unknown acqmode {}".format(self.acqmode)
+        # host time a channel's last block completed, see started()
+        self.completed = {}
+        self.dead_count = 0
+        self.dead_total = 0.0
+        self.dead_max = 0.0
+        self.dead_last = None
+        self.parse_time = 0.0
+        self.counts = {"write": 0, "query": 0, "errcheck": 0, "stb": 0}
+
+    def open_resource(self, port):
+        self.rm = pyvisa.ResourceManager() 
+        return self.rm.open_resource(port)
+
+    # session pool, see sessions.py
+    def check(self):
+        return self.querycmd("*IDN?").strip() != ""
+
+    def park(self):
+        # outputs to the stop state, the connection stays open
+        channels = list(self.applied_cmds) or [self.channel]
+        self.invalidate_config()
+        self.abort()
+        for ch in channels:
+            for cmd in SMU.stop_measurement_cmd_set.format(ch=ch).split("\n"):
+                if cmd.strip() != "":
+                    self.sendcmd(cmd)
+        print("SMU parked, transactions: {}, acquisition: {}".format(self.transactions(), self.acquisition_stats()))
+
+    def resume(self, custom_parameters={}):
+        self.set_parameters(custom_parameters)
+        self.pending_checks = []
+        self.checkerror(True)
 
     def applyV(self, v):
         raise Exception("This function should not be called: applyV(self,v)")
 
-    def configure(self, custom_parameters={}, reset_time=True):
+    def invalidate_config(self):
+        # next configure() resends the full command set (after errors, reconnects or manual changes)
+        self.applied_cmds = {}
+
+    def configure(self, custom_parameters={}, reset_time=True, force=False):
         # custom_parameters["measpoints"] = {"value": int(float(custom_parameters["period"]["value"])/float(custom_parameters["measinterval"]["value"]))}
+        # Configures the channel given in custom_parameters; the other channel keeps its setup
+        self.abort()
+        self.completed = {}
         for k,v in custom_parameters.items():
             setattr(self, k, v['value'])
         self.channel = int(self.channel)
@@ -195,26 +345,107 @@ SYST:TIME:TIM:COUN:RES:AUTO ON
             var1count = self.var1count
         ) 
 
-        self.inst.timeout = int(self.repeat) * int(self.var1count) * (float(self.pulsewidth) + float(self.pulsedelay)) * 1000 * 50 + 10000 
-
-        for cmd in start_measurement_cmd.split("\n"):
-            self.sendcmd(cmd)
-        if reset_time:
-            self.sendcmd("SYST:TIME:TIM:COUN:RES")
+        self.timeouts[self.channel] = int(self.repeat) * int(self.var1count) * (float(self.pulsewidth) + float(self.pulsedelay)) * 1000 * 50 + 10000 
+        self.inst.timeout = max(self.timeouts.values())
+
+        cmds = [cmd for cmd in start_measurement_cmd.split("\n") if cmd.strip() != ""]
+        previous = self.applied_cmds.pop(self.channel, None)
+        if force or previous is None or len(previous) != len(cmds):
+            previous = [None] * len(cmds)
+        # the template has a fixed order, so a line differs from the applied one only if its value changed
+        sent = 0
+        with self.batch("configure"):
+            for cmd, applied in zip(cmds, previous):
+                if cmd != applied:
+                    self.sendcmd(cmd)
+                    sent += 1
+            if reset_time:
+                self.sendcmd("SYST:TIME:TIM:COUN:RES")
+        self.applied_cmds[self.channel] = cmds
+        print("SMU ch{} configured: {} of {} commands sent".format(self.channel, sent, len(cmds)))
         
-    def measureVI(self):
-        data = []
-        data = (self.getSensData())
+    def arm(self, channels):
+        self.sendcmd("INIT (@{})".format(",".join(str(ch) for ch in channels)))
+        self.armed = list(channels)
+
+    def abort(self):
+        if self.armed is not None:
+            channels, self.armed = self.armed, None
+            self.sendcmd("ABOR (@{})".format(",".join(str(ch) for ch in channels)))
+
+    def waitcomplete(self):
         status = (self.querycmd("*OPC?"))
         while status != "1":
             status = (self.querycmd("*OPC?"))
-        return np.array(data)
+
+    def measureVI(self, channels=None):
+        # One block from the configured channel, or with a channel list one block per
+        # channel, all triggered by the same INIT so the channels measure concurrently.
+        chs = [self.channel] if channels is None else list(channels)
+        with self.batch("block"):
+            if self.acqmode == "fetch" or len(chs) > 1:
+                if self.armed != chs:
+                    self.abort()
+                    self.started(chs)
+                    self.arm(chs)
+                self.waitcomplete()
+                self.armed = None
+                self.finished(chs)
+                data = [self.getSensData(fetch=True, channel=ch) for ch in chs]
+                if self.acqmode == "fetch":
+                    self.started(chs)
+                    self.arm(chs)
+            else:
+                self.started(chs)
+                data = [self.getSensData(channel=chs[0])]
+                self.finished(chs, self.block_ready)
+                self.waitcomplete()
+        if self.errorpolicy == "block":
+            self.flusherrors()
+        return data[0] if channels is None else data
+
+    # Dead time: host time from the end of a block to the INIT or READ:ARR? of the
+    # next one, the instrument measures nothing in between. The end of a block is
+    # its *OPC? in fetch mode and the header of the READ:ARR? reply in read mode,
+    # so the transfer of the data counts as dead time in both. The TIME column
+    # cannot show it, SYST:TIME:TIM:COUN:RES:AUTO ON restarts the timer with every block.
+    def started(self, channels):
+        now = time.perf_counter()
+        for ch in channels:
+            if ch in self.completed:
+                dead_time = now - self.completed.pop(ch)
+                self.dead_count += 1
+                self.dead_total += dead_time
+                self.dead_max = max(self.dead_max, dead_time)
+                self.dead_last = dead_time
+
+    def finished(self, channels, end=None):
+        end = time.perf_counter() if end is None else end
+        for ch in channels:
+            self.completed[ch] = end
+
+    def acquisition_stats(self):
+        return {
+            "blocks_with_predecessor": self.dead_count,
+            "last_dead_time": self.dead_last,
+            "max_dead_time": self.dead_max if self.dead_count else None,
+            "total_dead_time": self.dead_total,
+            "parse_time": self.parse_time,
+        }
 
     def disconnect(self):
+        channels = list(self.applied_cmds) or [self.channel]
+        self.invalidate_config()
+        try:
+            self.abort()
+        except Exception:
+            pass
         try:
-            for cmd in SMU.stop_measurement_cmd_set.format(self.channel).split("\n"):
-                self.sendcmd(cmd)
+            for ch in channels:
+                for cmd in SMU.stop_measurement_cmd_set.format(ch=ch).split("\n"):
+                    if cmd.strip() != "":
+                        self.sendcmd(cmd)
         except Exception:
             pass
         self.inst.close()
-        print("SMU disconnected")
\ No newline at end of file
+        print("SMU disconnected, transactions: {}, acquisition: {}".format(self.transactions(), self.acquisition_stats()))
\ No newline at end of file
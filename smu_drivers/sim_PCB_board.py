@@ -0,0 +1,8 @@
+import simulators
+
+# PCB_board reading a simulated scope instead of a VISA resource.
+base = simulators.load_driver("smu_drivers", "PCB_board")
+
+class SMU(base.SMU):
+    def open_resource(self, port):
+        return simulators.SimScope(port)
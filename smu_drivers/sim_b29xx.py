@@ -0,0 +1,8 @@
+import simulators
+
+# agilent_b29xx (DC) talking to a simulated B2900 instead of a VISA resource.
+base = simulators.load_driver("smu_drivers", "agilent_b29xx")
+
+class SMU(base.SMU):
+    def open_resource(self, port):
+        return simulators.SimB29xx(port)
@@ -0,0 +1,9 @@
+import simulators
+
+# agilent_b29xx_pulse talking to a simulated B2900 instead of a VISA resource.
+# smu_port selects the link options, e.g. "sim?latency=0.001&bandwidth=4e6"
+base = simulators.load_driver("smu_drivers", "agilent_b29xx_pulse")
+
+class SMU(base.SMU):
+    def open_resource(self, port):
+        return simulators.SimB29xx(port)
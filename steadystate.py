@@ -0,0 +1,61 @@
+import time
+import numpy as np
+
+# Early end of the stress or recovery phase of a pixel, from the streamed
+# blocks (V, I, T columns), timed on the host as they arrive. A phase ends before smu_t_total / smu_t_total_rec,
+# but never before steady_min_time / steady_min_time_rec seconds, when
+#   - "steady_enable" is set and the mean current of the last steady_blocks
+#     blocks drifted by less than steady_slope_tol A/s from block to block, or
+#   - "smu_recovery_enable" is set and the stress current rose above
+#     "smu_rec_thresh" (stress only).
+# DC samples are grouped into blocks of steady_dc_cycles voltage profiles, so
+# every block holds the same voltages.
+
+class Detector:
+    def __init__(self, conf, phase, rows=None) -> None:
+        recovery = phase == "recovery"
+        self.enable = conf.get("steady_enable", False)
+        self.min_time = conf.get("steady_min_time_rec" if recovery else "steady_min_time", 30)
+        self.blocks = conf.get("steady_blocks", 5)
+        self.slope_tol = conf.get("steady_slope_tol", 1e-9)
+        self.threshold = conf.get("smu_rec_thresh") if not recovery and conf.get("smu_recovery_enable") else None
+        self.rows = rows        # rows per block of DC samples, None: blocks as measured
+        self.buffer = []
+        self.start = time.time()
+        self.previous = None    # (time, mean current) of the last block
+        self.steady = 0         # consecutive blocks within the slope tolerance
+        self.crossed = False
+        self.reason = None
+
+    def active(self):
+        return self.enable or self.threshold is not None
+
+    def update(self, data):
+        # reason to end the phase now, None to go on
+        if not self.active():
+            return None
+        if self.rows is not None:
+            self.buffer.extend(data)
+            if len(self.buffer) < self.rows:
+                return None
+            data, self.buffer = self.buffer, []
+        block = np.asarray(data, dtype=float)
+        if block.ndim != 2 or len(block) == 0:
+            return None
+        i = block[:,1]
+        if self.threshold is not None and i.max() > self.threshold:
+            self.crossed = True
+        if self.enable:
+            # host time of the block: the SMU TIME column restarts with every block
+            t, mean = time.time(), i.mean()
+            if self.previous is not None and t > self.previous[0]:
+                slope = (mean - self.previous[1]) / (t - self.previous[0])
+                self.steady = self.steady + 1 if abs(slope) < self.slope_tol else 0
+            self.previous = (t, mean)
+        if time.time() - self.start < self.min_time:
+            return None
+        if self.crossed:
+            self.reason = "current above smu_rec_thresh {}".format(self.threshold)
+        elif self.enable and self.steady >= self.blocks:
+            self.reason = "drift below {} A/s for {} blocks".format(self.slope_tol, self.steady)
+        return self.reason
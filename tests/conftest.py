@@ -0,0 +1,21 @@
+import os
+import sys
+import json
+import pytest
+
+# The modules are flat in the repository root and the drivers are loaded by
+# relative path (smu_drivers/<name>.py), so the tests run from the root.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    monkeypatch.chdir(root)
+
+@pytest.fixture
+def pulse_conf():
+    with open(os.path.join(root, "conf_pulse.json")) as f:
+        conf = json.load(f)
+    conf.update(ispulseused=True, Vr_prof=-0.5, Vf_prof_arr=[0.2, 0.5], Duty_cycles=[0.25, 0.5], smu_periods_arr=[0.001, 0.002])
+    conf["pixel_loop"]["loop"] = [{"ext": "R0", "inn": "G{}".format(k), "curr": 0.01 * (1 + k % 2)} for k in range(4)]
+    return conf
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+import pytest
+import planner
+import simulators
+
+driver = simulators.load_driver("smu_drivers", "sim_b29xx_pulse")
+
+def block(values):
+    payload = np.asarray(values, dtype=">f8").tobytes()
+    length = str(len(payload)).encode()
+    return b"#" + str(len(length)).encode() + length + payload + b"\n"
+
+def make_smu(pulse_conf, port="sim?latency=0&bandwidth=1e12", **values):
+    pars = dict(pulse_conf["smu_custom_pars"])
+    for k, v in values.items():
+        pars[k] = {"value": v}
+    pars["var1count"] = {"value": 1000}
+    pars["repeat"] = {"value": 1}
+    smu = driver.SMU(port, pars)
+    smu.configure(planner.pulse_conf(dict(pulse_conf, smu_custom_pars=pars), 0.001, 0.5, 0.5))
+    return smu
+
+def test_readblock_keeps_newline_bytes_in_the_payload(pulse_conf):
+    smu = make_smu(pulse_conf)
+    values = [1.0, 2.0, 3.0, np.frombuffer(b"\x0a" * 8, dtype=">f8")[0]]
+    raw = block(values)
+    assert b"\n" in raw[:-1]
+    smu.inst.responses.append(raw)
+    payload = smu.readblock()
+    assert np.array_equal(np.frombuffer(payload, dtype=">f8"), np.asarray(values, dtype=">f8"))
+    # the terminator was read with the block, nothing is left behind
+    with pytest.raises(TimeoutError):
+        smu.inst.read_bytes(1)
+
+def test_readblock_rejects_indefinite_blocks(pulse_conf):
+    smu = make_smu(pulse_conf)
+    smu.inst.responses.append(b"#0" + b"\x00" * 16 + b"\n")
+    with pytest.raises(Exception, match="header"):
+        smu.readblock()
+
+def test_measure_reads_the_requested_channel(pulse_conf):
+    smu = make_smu(pulse_conf)
+    data = smu.measureVI()
+    assert data.shape == (1000, 3)
+    assert np.allclose(data[:,0], 0.5, atol=1e-3)
+
+@pytest.mark.parametrize("acqmode", ["read", "fetch"])
+def test_dead_time_includes_the_transfer(pulse_conf, acqmode):
+    # 24 kB blocks at 1 MB/s: the transfer takes 24 ms, and nothing else happens
+    # between two blocks, so the dead time is mostly the transfer in both modes
+    smu = make_smu(pulse_conf, "sim?latency=0&bandwidth=1e6", acqmode=acqmode)
+    for _ in range(4):
+        smu.measureVI()
+    stats = smu.acquisition_stats()
+    assert stats["blocks_with_predecessor"] >= 3
+    assert stats["last_dead_time"] >= 0.02
+    assert stats["max_dead_time"] >= stats["last_dead_time"]
+    assert stats["total_dead_time"] >= stats["blocks_with_predecessor"] * 0.02
+
+def test_dead_time_counts_host_time_between_blocks(pulse_conf):
+    smu = make_smu(pulse_conf)
+    smu.measureVI()
+    time.sleep(0.05)
+    smu.measureVI()
+    assert smu.acquisition_stats()["last_dead_time"] >= 0.05
+
+def test_failed_batch_does_not_leave_pending_checks(pulse_conf):
+    smu = make_smu(pulse_conf, errorpolicy="batch")
+    with pytest.raises(RuntimeError):
+        with smu.batch("configure"):
+            smu.sendcmd("SOUR1:VOLT 0")
+            smu.inst.errors.append('-113,"Undefined header"')
+            raise RuntimeError("failed in the batch")
+    assert smu.pending_checks == []
+    assert smu.inst.errors == []
+    with smu.batch("block"):
+        smu.sendcmd("SOUR1:VOLT 0")
@@ -0,0 +1,69 @@
+import json
+import numpy as np
+import pytest
+import checkpoint
+import writers
+
+pixel = {"ext": "R0", "inn": "G1", "curr": 0.01}
+
+def step(writer, folder, k, rows=10):
+    with writer.segment(pixel, 0.001, 0.5, 0.5 + k):
+        writer.write(np.full((rows, 3), float(k)))
+    entry = {"step": k, "Period": 0.001, "Vf": 0.5, "Duty": 0.5 + k, "pixels": ["R0G1"], "files": writer.sync()}
+    checkpoint.append(folder, entry)
+    return entry
+
+@pytest.mark.parametrize("name", ["text", "binary"])
+def test_resume_cuts_the_interrupted_step(tmp_path, name):
+    writer = writers.writers[name](tmp_path)
+    entry = step(writer, tmp_path, 0)
+    # the interrupted step: data written, no checkpoint entry
+    with writer.segment(pixel, 0.001, 0.5, 1.5):
+        writer.write(np.ones((5, 3)))
+    writer.close()
+    with open(tmp_path / checkpoint.checkpoint_name, "a") as f:
+        f.write('{"step": 1, "Per')
+    completed, entries, files = checkpoint.load(tmp_path)
+    assert completed == {0}
+    assert entries == [entry]
+    assert (tmp_path / checkpoint.checkpoint_name).read_text().endswith("}\n")
+    checkpoint.truncate(tmp_path, files)
+    on_disk = {path.name: path.stat().st_size for path in tmp_path.iterdir() if path.name != checkpoint.checkpoint_name}
+    assert on_disk == files
+
+def test_resume_rejects_a_file_shorter_than_recorded(tmp_path):
+    writer = writers.BinaryChunkWriter(tmp_path)
+    step(writer, tmp_path, 0)
+    step(writer, tmp_path, 1)
+    writer.close()
+    _, _, files = checkpoint.load(tmp_path)
+    data = tmp_path / "data.bin"
+    with open(data, "r+b") as f:
+        f.truncate(files["data.bin"] - 8)
+    index_size = (tmp_path / "data_index.jsonl").stat().st_size
+    with pytest.raises(Exception, match="data.bin"):
+        checkpoint.truncate(tmp_path, files)
+    # nothing was cut before the check failed
+    assert (tmp_path / "data_index.jsonl").stat().st_size == index_size
+
+def test_resume_rejects_a_missing_file(tmp_path):
+    writer = writers.TextWriter(tmp_path)
+    step(writer, tmp_path, 0)
+    writer.close()
+    _, _, files = checkpoint.load(tmp_path)
+    for name in files:
+        (tmp_path / name).unlink()
+    with pytest.raises(Exception, match="has 0 bytes"):
+        checkpoint.truncate(tmp_path, files)
+
+def test_binary_writer_keeps_numbering_segments_on_resume(tmp_path):
+    writer = writers.BinaryChunkWriter(tmp_path)
+    step(writer, tmp_path, 0)
+    writer.close()
+    writer = writers.BinaryChunkWriter(tmp_path)
+    step(writer, tmp_path, 1)
+    writer.close()
+    with open(tmp_path / "data_index.jsonl") as f:
+        chunks = [json.loads(line) for line in f]
+    assert [chunk["segment"] for chunk in chunks] == [1, 2]
+    assert chunks[1]["offset"] == chunks[0]["rows"] * chunks[0]["cols"] * 8
@@ -0,0 +1,43 @@
+import numpy as np
+import liveview
+
+def pulse_block(rows, step=0.001):
+    # the TIME column restarts with every block (SYST:TIME:TIM:COUN:RES:AUTO ON)
+    block = np.zeros((rows, 3))
+    block[:,1] = 1.0
+    block[:,2] = step * np.arange(1, rows + 1)
+    return block
+
+def test_time_axis_increases_across_restarting_blocks():
+    live = liveview.LiveView(points=40)
+    updates = []
+    live.subscribe(updates.append)
+    live.begin("R0G1", 0)
+    for _ in range(5):
+        live.push("R0G1", pulse_block(100))
+    live.update()
+    t = updates[-1]["t"]
+    assert len(t) <= 40
+    assert np.all(np.diff(t) > 0)
+    assert t[-1] > 0.4
+
+def test_new_segment_starts_a_new_trace():
+    live = liveview.LiveView(points=40)
+    updates = []
+    live.subscribe(updates.append)
+    live.begin("R0G1", 0)
+    live.push("R0G1", pulse_block(10))
+    live.update()
+    live.begin("R0G1", 0)
+    live.push("R0G1", [[0.5, 1.0, 2.0]])
+    live.update()
+    assert updates[-1]["new"]
+    assert list(updates[-1]["t"]) == [2.0]
+
+def test_envelope_keeps_the_extremes():
+    t = np.arange(10.0)
+    lo = np.arange(10.0)[:,None].repeat(2, axis=1)
+    hi = lo + 1
+    t2, lo2, hi2 = liveview.envelope(t, lo, hi, 3)
+    assert len(t2) == 3
+    assert lo2.min() == 0 and hi2.max() == 10
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import simulators
+
+driver = simulators.load_driver("smu_drivers", "sim_PCB_board")
+
+def make_smu(**values):
+    pars = {"threshold": "0", "shift": "0", "trig_ch": "1", "data_ch": "2"}
+    pars.update(values)
+    return driver.SMU("sim?latency=0&bandwidth=1e12", {k: {"value": v} for k, v in pars.items()})
+
+def test_rising_edges():
+    smu = make_smu()
+    trig = np.array([[-1, 1, 1, -1, -1, 1], [1, 1, -1, 1, -1, -1]], dtype=float)
+    records, samples = smu.rising_edges(trig)
+    assert list(zip(records, samples)) == [(0, 0), (0, 4), (1, 2)]
+
+def test_hysteresis_ignores_noise_around_the_threshold():
+    smu = make_smu(hysteresis="0.5")
+    # wiggles inside the band, one real crossing from low to high
+    trig = np.array([[-1, 0.1, -0.1, 0.1, 1, 0.1, 1, 1]], dtype=float)
+    records, samples = smu.rising_edges(trig)
+    assert list(zip(records, samples)) == [(0, 3)]
+
+def test_edge_values_window_and_shift():
+    smu = make_smu(shift="1", window="2")
+    trig = np.array([[-1, 1, 1, -1, 1, 1, -1, -1]], dtype=float)
+    sig = np.arange(8, dtype=float)[None,:]
+    records, samples, values = smu.edge_values(trig, sig)
+    # edges between samples 0/1 and 3/4, averaged over samples 1..2 and 4..5
+    assert list(samples) == [0, 3]
+    assert np.allclose(values, [1.5, 4.5])
+
+def test_per_record_statistics():
+    smu = make_smu()
+    records = np.array([0, 0, 2, 2, 2])
+    values = np.array([1.0, 3.0, 2.0, 4.0, 6.0])
+    stats = smu.per_record(3, records, values)
+    assert list(stats["edges"]) == [2, 0, 3]
+    assert np.allclose(stats["mean"][[0, 2]], [2.0, 4.0])
+    assert np.allclose(stats["std"][[0, 2]], [1.0, np.std([2.0, 4.0, 6.0])])
+    assert np.isnan(stats["min"][1]) and np.isnan(stats["max"][1])
+    assert stats["max"][2] == 6.0
+
+def test_segmented_records_are_handed_over_once():
+    smu = make_smu(mode="segmented", frames="5", window="3", shift="30")
+    block = smu.measureVI()
+    records = smu.pop_records()
+    assert smu.pop_records() is None
+    assert len(records) == 5
+    assert records["edges"].sum() == len(block)
+    assert np.all(np.diff(records["time"]) > 0)
+    # the records of the next transfer follow on the time axis
+    smu.measureVI()
+    assert smu.pop_records()["time"][0] > records["time"][-1]
+    assert np.all(np.diff(block[:,2]) > 0)
+    smu.disconnect()
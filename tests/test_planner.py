@@ -0,0 +1,48 @@
+import planner
+
+def pixel_names(conf, plan):
+    return [[pixel["ext"] + pixel["inn"] for pixel in pixels] for _, _, _, pixels in planner.plan_steps(conf, plan)]
+
+def test_legacy_order_is_the_plain_nested_loop(pulse_conf):
+    plan = planner.make_plan(pulse_conf)
+    assert plan["order"] == planner.legacy_order
+    assert not plan["serpentine"]
+    expected = []
+    for Period in pulse_conf["smu_periods_arr"]:
+        for Vf in pulse_conf["Vf_prof_arr"]:
+            for Duty in pulse_conf["Duty_cycles"]:
+                for pixel in pulse_conf["pixel_loop"]["loop"]:
+                    expected.append((Period, Vf, Duty, [pixel]))
+    assert planner.plan_steps(pulse_conf, plan) == expected
+
+def test_explicit_order_has_no_serpentine(pulse_conf):
+    pulse_conf["plan_order"] = ["pixel", "Period", "Vf", "Duty"]
+    plan = planner.make_plan(pulse_conf)
+    assert plan["order"] == pulse_conf["plan_order"]
+    assert not plan["serpentine"]
+
+def test_serpentine_only_when_asked(pulse_conf):
+    pulse_conf["plan_serpentine"] = True
+    plan = planner.make_plan(pulse_conf)
+    assert plan["order"] == planner.legacy_order
+    assert plan["serpentine"]
+    # the pixel loop turns around at the end of every Duty pass
+    assert pixel_names(pulse_conf, plan)[3:5] == [["R0G3"], ["R0G3"]]
+
+def test_auto_is_not_worse_than_legacy(pulse_conf):
+    pulse_conf["plan_order"] = "auto"
+    plan = planner.make_plan(pulse_conf)
+    assert plan["estimate"]["switch_time"] <= plan["legacy_estimate"]["switch_time"]
+    assert len(plan["steps"]) == 2 * 2 * 2 * 4
+
+def test_auto_respects_constraints(pulse_conf):
+    pulse_conf["plan_order"] = "auto"
+    pulse_conf["plan_constraints"] = [["Period", "Duty"], ["Vf", "pixel"]]
+    order = planner.make_plan(pulse_conf)["order"]
+    assert order.index("Period") < order.index("Duty")
+    assert order.index("Vf") < order.index("pixel")
+
+def test_pixel_groups_share_the_led_current():
+    pixels = [{"ext": "R0", "inn": "G{}".format(k), "curr": curr} for k, curr in enumerate([1, 1, 1, 2, 2])]
+    groups = planner.pixel_groups(pixels, 2)
+    assert [[pixel["inn"] for pixel in group] for group in groups] == [["G0", "G1"], ["G2"], ["G3", "G4"]]
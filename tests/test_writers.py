@@ -0,0 +1,103 @@
+import json
+import numpy as np
+import pytest
+import reader
+import reducers
+import writers
+
+def run_conf(folder, pixels, output_format):
+    conf = {"pixel_loop": {"loop": pixels}, "output_format": output_format}
+    with open(folder / "conf.json", "w") as f:
+        json.dump(conf, f)
+    return conf
+
+def blocks(n, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    out = []
+    for k in range(n):
+        block = rng.normal(size=(rows, 3))
+        block[:,2] = k * rows + np.arange(rows)
+        out.append(block)
+    return out
+
+@pytest.mark.parametrize("output_format", ["text", "binary"])
+@pytest.mark.parametrize("queue_size", [0, 4])
+def test_written_segments_read_back(tmp_path, output_format, queue_size):
+    pixel = {"ext": "R0", "inn": "G1", "curr": 0.01}
+    conf = run_conf(tmp_path, [pixel], output_format)
+    conf["output_queue_size"] = queue_size
+    writer = writers.make_writer(conf, tmp_path)
+    stress, recovery = blocks(3, 50), blocks(2, 40, seed=1)
+    with writer.segment(pixel, 0.001, 0.5, 0.25, "stress"):
+        for block in stress:
+            writer.write(block)
+        writer.set_phase("recovery")
+        for block in recovery:
+            writer.write(block)
+    writer.close()
+    run = reader.RunFolder(tmp_path)
+    for phase, expected in [("stress", stress), ("recovery", recovery)]:
+        [segment] = run.select(pixel="R0G1", Duty=0.25, phase=phase)
+        assert np.allclose(segment.load(), np.concatenate(expected))
+    with open(reducers.summary_file(tmp_path, "R0G1", 0.001, 0.5, 0.25)) as f:
+        summary = json.load(f)
+    assert summary["phases"]["stress"]["welford"]["n"] == 150
+    assert summary["phases"]["recovery"]["welford"]["n"] == 80
+
+def test_text_conversion_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(reader, "chunk_rows", 7)
+    pixel = {"ext": "R0", "inn": "G2", "curr": 0.01}
+    conf = run_conf(tmp_path, [pixel], "text")
+    writer = writers.TextWriter(tmp_path)
+    data = blocks(4, 25)
+    with writer.segment(pixel, 0.001, 0.5, 0.5):
+        writer.write(np.concatenate(data[:2]))
+        writer.set_phase("recovery")
+        writer.write(np.concatenate(data[2:]))
+    writer.close()
+    run = reader.RunFolder(tmp_path)
+    assert [(s.phase, s.rows) for s in run.segments] == [("stress", 50), ("recovery", 50)]
+    assert np.allclose(run.load(), np.concatenate(data))
+    # the second open uses the cache
+    assert np.allclose(reader.RunFolder(tmp_path).load(phase="recovery"), np.concatenate(data[2:]))
+
+def test_welford_matches_numpy():
+    data = blocks(5, 33)
+    welford = reducers.Welford({})
+    for block in data:
+        welford.update(block)
+    result = welford.result()
+    x = np.concatenate(data)
+    assert result["n"] == len(x)
+    assert np.isclose(result["mean"]["I"], x[:,1].mean())
+    assert np.isclose(result["var"]["V"], x[:,0].var(ddof=1))
+
+def test_minmax_and_block_table():
+    data = blocks(3, 20)
+    minmax = reducers.MinMax({})
+    table = reducers.BlockTable({})
+    for block in data:
+        minmax.update(block)
+        table.update(block)
+    x = np.concatenate(data)
+    assert minmax.result()["max"]["I"] == x[:,1].max()
+    rows = table.result()["rows"]
+    assert [row[2] for row in rows] == [20, 20, 20]
+    assert rows[1][0] == data[1][0,2]
+
+def test_summary_keeps_records(tmp_path):
+    stage = reducers.Stage({}, tmp_path)
+    pixel = {"ext": "R0", "inn": "G3", "curr": 0.01}
+    stage.begin(pixel, 0.001, 0.5, 0.5)
+    stage.update(blocks(1, 10)[0])
+    records = np.zeros(2, dtype=[("time", "f8"), ("edges", "i8")])
+    records["edges"] = [3, 4]
+    stage.add_records(records)
+    stage.end()
+    with open(reducers.summary_file(tmp_path, "R0G3", 0.001, 0.5, 0.5)) as f:
+        summary = json.load(f)
+    assert summary["phases"]["stress"]["records"] == {"columns": ["time", "edges"], "rows": [[0.0, 3], [0.0, 4]]}
+
+def test_unknown_reducer(tmp_path):
+    with pytest.raises(Exception, match="Unknown reducer"):
+        reducers.Stage({"reducers": ["median"]}, tmp_path)
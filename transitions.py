@@ -0,0 +1,79 @@
+import time
+import concurrent.futures as cf
+import numpy as np
+
+# Pixel transitions: switching the relays (COMM), setting the LED current and
+# configuring the SMU talk over independent links, so they run at the same time
+# on a small thread pool. "transition_order" lists [before, after] pairs of steps
+# that must not overlap, by default [["relay", "led"]]: the LED is only set once
+# the relays switched. Add ["relay", "smu"] to never switch relays while the SMU
+# changes its output. "transition_workers": 0 runs the steps one after another.
+default_order = [["relay", "led"]]
+
+class Transition:
+    def __init__(self, conf) -> None:
+        self.order = conf.get("transition_order", default_order)
+        workers = conf.get("transition_workers", 3)
+        self.pool = cf.ThreadPoolExecutor(workers, thread_name_prefix="transition") if workers > 0 else None
+        self.latencies = []     # wall time of every transition, the critical path
+        self.serial_times = []  # sum of its step times, what it took one after another
+        self.critical = {}      # step that finished last -> count
+
+    def after(self, name, steps):
+        return [before for before, after in self.order if after == name and before in steps]
+
+    def run(self, steps):
+        # steps: {name: function}; returns when all are done, raises the first error
+        start = time.perf_counter()
+        durations = {}
+        def timed(name):
+            t = time.perf_counter()
+            steps[name]()
+            durations[name] = time.perf_counter() - t
+        waiting = dict((name, set(self.after(name, steps))) for name in steps)
+        done = []
+        if self.pool is None:
+            while waiting:
+                name = next(name for name, before in waiting.items() if before.issubset(done))
+                del waiting[name]
+                timed(name)
+                done.append(name)
+        else:
+            running = {}
+            error = None
+            while waiting or running:
+                if error is None:
+                    for name in [name for name, before in waiting.items() if before.issubset(done)]:
+                        del waiting[name]
+                        running[self.pool.submit(timed, name)] = name
+                if not running:
+                    break
+                finished, _ = cf.wait(running, return_when=cf.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        # let the other links finish, start nothing new
+                        error = error or future.exception()
+                    else:
+                        done.append(name)
+            if error is not None:
+                raise error
+        self.latencies.append(time.perf_counter() - start)
+        self.serial_times.append(sum(durations.values()))
+        self.critical[done[-1]] = self.critical.get(done[-1], 0) + 1
+
+    def stats(self):
+        if not self.latencies:
+            return {"transitions": 0}
+        latencies = np.array(self.latencies)
+        return {
+            "transitions": len(latencies),
+            "mean_latency": float(latencies.mean()),
+            "max_latency": float(latencies.max()),
+            "mean_serial_time": float(np.mean(self.serial_times)),
+            "critical_step": self.critical,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
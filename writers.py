@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import queue
+import traceback
+import threading as T
+from contextlib import contextmanager
+import numpy as np
+import reducers
+
+# Output backends for Run. Blocks are passed in the SMU column order
+# (V, I, T), the same as FORM:ELEM:SENS VOLT,CURR,TIME on the B29xx.
+
+class Writer:
+    rows = 0
+    bytes_written = 0
+    write_time = 0.0
+
+    @contextmanager
+    def segment(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.begin(pixel, Period, Vf, Duty, phase)
+        try:
+            yield self
+        finally:
+            self.end()
+
+    def write_records(self, records):
+        # per-record statistics of a segmented SMU (PCB_board), only kept by the reducers
+        pass
+
+    def stats(self):
+        return {"rows": self.rows, "bytes": self.bytes_written, "write_time": self.write_time}
+
+class TextWriter(Writer):
+    header = "#pixel_time[s]\tV[V]\tI[A]"
+
+    def __init__(self, outputfolder, name="data") -> None:
+        self.outputfolder = outputfolder
+        self.f = None
+        self.key = None
+        self.files = set()
+        self.unsynced = set()   # files written since the last sync()
+
+    def filename(self, pixel, Period, Vf, Duty):
+        return "{}/{}{}_TimeStep-{}_Vf-{}_Duty-{}.txt".format(self.outputfolder, pixel["ext"], pixel["inn"], Period, Vf, Duty)
+
+    def begin(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.key = {"pixel": pixel["ext"] + pixel["inn"], "Period": Period, "Vf": Vf, "Duty": Duty, "phase": phase}
+        self.f = open(self.filename(pixel, Period, Vf, Duty), 'a')
+        self.files.add(self.f.name)
+        self.unsynced.add(self.f.name)
+        print(self.header, file=self.f)
+
+    def set_phase(self, phase):
+        # a new header, marked with the phase, so readers can split the file
+        self.key["phase"] = phase
+        print("#phase {}".format(phase), file=self.f)
+        print(self.header, file=self.f)
+
+    def write(self, data):
+        start = time.perf_counter()
+        data = np.asarray(data)
+        if data.shape[0] == 0:
+            return
+        lines = map("{}\t{}\t{}".format, data[:,2].tolist(), data[:,0].tolist(), data[:,1].tolist())
+        text = "\n".join(lines) + "\n"
+        self.f.write(text)
+        self.rows += data.shape[0]
+        self.bytes_written += len(text)
+        self.write_time += time.perf_counter() - start
+
+    def write_row(self, t, v, i):
+        start = time.perf_counter()
+        text = "{}\t{}\t{}\n".format(t, v, i)
+        self.f.write(text)
+        self.rows += 1
+        self.bytes_written += len(text)
+        self.write_time += time.perf_counter() - start
+
+    def end(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def sync(self):
+        # sizes of the files written so far, for the run checkpoint; on disk
+        # before the checkpoint records them
+        if self.f is not None:
+            self.f.flush()
+        for name in self.unsynced:
+            if self.f is not None and name == self.f.name:
+                os.fsync(self.f.fileno())
+            else:
+                with open(name, "ab") as f:
+                    os.fsync(f.fileno())
+        self.unsynced = {self.f.name} if self.f is not None else set()
+        return {os.path.basename(name): os.path.getsize(name) for name in self.files}
+
+    def close(self):
+        self.end()
+
+class BinaryChunkWriter(Writer):
+    # All blocks of a run go into one container (<name>.bin, data.bin by default) as
+    # raw little-endian float64 chunks. Every chunk gets a line in <name>_index.jsonl
+    # with its byte offset, shape and the pixel/Period/Vf/Duty/phase it belongs to.
+    columns = ["V", "I", "T"]
+    dtype = np.dtype("<f8")
+    row_buffer_size = 4096
+
+    def __init__(self, outputfolder, name="data") -> None:
+        self.outputfolder = outputfolder
+        self.data_name = "{}.bin".format(name)
+        self.index_name = "{}_index.jsonl".format(name)
+        self.f = open("{}/{}".format(outputfolder, self.data_name), 'ab')
+        self.index = open("{}/{}".format(outputfolder, self.index_name), 'a')
+        self.offset = self.f.tell()
+        self.key = None
+        self.row_buffer = []
+        self.segment_no = 0
+        if self.index.tell() > 0:
+            # resumed run: keep numbering the segments after the existing ones
+            with open("{}/{}".format(outputfolder, self.index_name)) as index:
+                for line in index:
+                    self.segment_no = max(self.segment_no, json.loads(line)["segment"])
+
+    def begin(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.key = {"pixel": pixel["ext"] + pixel["inn"], "Period": Period, "Vf": Vf, "Duty": Duty, "phase": phase}
+        self.segment_no += 1
+
+    def set_phase(self, phase):
+        self.flush_rows()
+        self.key["phase"] = phase
+
+    def write(self, data):
+        start = time.perf_counter()
+        block = np.ascontiguousarray(data, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[0] == 0:
+            return
+        self.f.write(block.data)
+        entry = dict(self.key, segment=self.segment_no, offset=self.offset, rows=block.shape[0], cols=block.shape[1], dtype=self.dtype.str, columns=self.columns)
+        self.index.write(json.dumps(entry) + "\n")
+        self.offset += block.nbytes
+        self.rows += block.shape[0]
+        self.bytes_written += block.nbytes
+        self.write_time += time.perf_counter() - start
+
+    def write_row(self, t, v, i):
+        # DC mode produces one sample at a time; collect them into one chunk
+        self.row_buffer.append((v, i, t))
+        if len(self.row_buffer) >= self.row_buffer_size:
+            self.flush_rows()
+
+    def flush_rows(self):
+        if self.row_buffer:
+            rows, self.row_buffer = self.row_buffer, []
+            self.write(np.array(rows, dtype=self.dtype))
+
+    def end(self):
+        self.flush_rows()
+        self.f.flush()
+        self.index.flush()
+
+    def sync(self):
+        self.end()
+        os.fsync(self.f.fileno())
+        os.fsync(self.index.fileno())
+        return {self.data_name: self.offset, self.index_name: os.path.getsize(self.index.name)}
+
+    def close(self):
+        self.end()
+        self.f.close()
+        self.index.close()
+
+class ReducingWriter(Writer):
+    # Passes every block through a reducers.Stage before another writer, which
+    # writes a summary file per segment next to the raw data.
+    def __init__(self, writer, stage) -> None:
+        self.writer = writer
+        self.stage = stage
+
+    def begin(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.stage.begin(pixel, Period, Vf, Duty, phase)
+        self.writer.begin(pixel, Period, Vf, Duty, phase)
+
+    def set_phase(self, phase):
+        self.stage.set_phase(phase)
+        self.writer.set_phase(phase)
+
+    def write(self, data):
+        self.stage.update(data)
+        self.writer.write(data)
+
+    def write_row(self, t, v, i):
+        self.stage.add_row(t, v, i)
+        self.writer.write_row(t, v, i)
+
+    def write_records(self, records):
+        self.stage.add_records(records)
+
+    def end(self):
+        self.stage.end()
+        self.writer.end()
+
+    def sync(self):
+        return self.writer.sync()
+
+    def stats(self):
+        return dict(self.writer.stats(), reduce_time=self.stage.reduce_time)
+
+    def close(self):
+        self.stage.end()
+        self.writer.close()
+
+class QueuedWriter(Writer):
+    # Runs another writer on its own thread behind a bounded queue, so the
+    # acquisition loop only pays for a put(). A full queue blocks the
+    # producer (backpressure); the time spent blocked is counted as stall time.
+    def __init__(self, writer, maxsize=4) -> None:
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.items = 0
+        self.max_depth = 0
+        self.stall_time = 0.0
+        self.thread = T.Thread(target=self.consume, daemon=True)
+        self.thread.start()
+
+    def put(self, op, *args):
+        if self.error is not None:
+            raise Exception("Writer thread failed: {}".format(self.error))
+        start = time.perf_counter()
+        self.queue.put((op, args))
+        self.stall_time += time.perf_counter() - start
+        self.items += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def consume(self):
+        while True:
+            op, args = self.queue.get()
+            if op is None:
+                break
+            if op == "sync":
+                sizes, done = args
+                if self.error is None:
+                    try:
+                        sizes.update(self.writer.sync())
+                    except Exception as e:
+                        self.error = e
+                        print(traceback.format_exc())
+                done.set()
+                continue
+            if self.error is not None:
+                continue   # keep draining so the producer never blocks on a dead writer
+            try:
+                getattr(self.writer, op)(*args)
+            except Exception as e:
+                self.error = e
+                print(traceback.format_exc())
+
+    def begin(self, pixel, Period, Vf, Duty, phase="stress"):
+        self.put("begin", pixel, Period, Vf, Duty, phase)
+
+    def set_phase(self, phase):
+        self.put("set_phase", phase)
+
+    def write(self, data):
+        self.put("write", data)
+
+    def write_row(self, t, v, i):
+        self.put("write_row", t, v, i)
+
+    def write_records(self, records):
+        self.put("write_records", records)
+
+    def end(self):
+        self.put("end")
+
+    def sync(self):
+        # waits until everything queued so far is written
+        sizes = {}
+        done = T.Event()
+        self.put("sync", sizes, done)
+        done.wait()
+        if self.error is not None:
+            raise Exception("Writer thread failed: {}".format(self.error))
+        return sizes
+
+    def stats(self):
+        return dict(self.writer.stats(), depth=self.queue.qsize(), max_depth=self.max_depth, items=self.items, stall_time=self.stall_time)
+
+    def close(self):
+        # flush everything queued so far, then stop the thread
+        if self.thread.is_alive():
+            self.queue.put(("close", ()))
+            self.queue.put((None, ()))
+            self.thread.join()
+            print("Writer queue: {}".format(self.stats()))
+        if self.error is not None:
+            raise Exception("Writer thread failed: {}".format(self.error))
+
+writers = {
+    "text": TextWriter,
+    "binary": BinaryChunkWriter,
+}
+
+def make_writer(conf, outputfolder, name="data"):
+    output_format = conf.get("output_format", "text")
+    if output_format not in writers:
+        raise Exception("Unknown output_format: {}".format(output_format))
+    writer = writers[output_format](outputfolder, name)
+    if conf.get("reducers", reducers.default_reducers):
+        # on the writer thread too when queued
+        writer = ReducingWriter(writer, reducers.Stage(conf, outputfolder))
+    queue_size = conf.get("output_queue_size", 4)
+    if queue_size > 0:
+        writer = QueuedWriter(writer, queue_size)
+    return writer